@@ -1,9 +1,65 @@
 from simon_device import *
 import itertools
 
-def run_simulation_fatigue(model="simon-motivation-model3", param_set=None, n_simulation=100, n_session=1, verbose=True, log=True, special_suffix=""):
+def run_fatigue_epoch(model="simon-motivation-model3", param_set=None, epoch=0, n_session=1, verbose=True, time_suffix="", base_seed=SEED):
+    """
+    Run all sessions of one fatigue epoch. Motivation is raised to 10 from the 7th session on
+    Session seeds are derived from (base_seed, initial param_set, epoch, session), see run_epoch()
+    Return: (simulation_model, simulation_trace, session_params)
+    """
+    if verbose: print("Epoch #%03d" % epoch)
+    stream = SeedStream(base_seed, param_set) if base_seed is not None else None
+
+    # every epoch starts from the given parameters
+    param_set = dict(param_set) if param_set else {}
+
+    # number of sessions per experiment
+    dffs_model = []
+    dffs_trace = []
+    dataframes_params = []
+    for i in range(n_session):
+        if verbose: print("\tSession #%03d" % i)
+        if i<6:
+            pass
+        else:
+            param_set["motivation"] = 10
+        print(i, param_set)
+        session = run_experiment(model,
+                                 reload=(not i),
+                                 visible=False,
+                                 verbose=True,
+                                 trace=False,
+                                 param_set=param_set,
+                                 seeds=stream.session_seeds(epoch, i) if stream else None)
+        session_model=session.df_stats_model_outputs()
+        session_trace=session.df_stats_trace_outputs()
+
+        # log parameter file
+        session_params = pd.Series(session.parameters)
+        session_params['file_suffix'] = str(time_suffix)
+        session_params['session'] = i+1
+
+        # log session index
+        session_model.insert(0, "session", i+1)
+        session_trace.insert(0, "session", i+1)
+
+        dffs_model.append(session_model)
+        dffs_trace.append(session_trace)
+        dataframes_params.append(session_params)
+
+
+    simulation_model = pd.concat(dffs_model, axis=0)
+    simulation_trace = pd.concat(dffs_trace, axis=0)
+
+    # log simulation index
+    simulation_model.insert(0, "epoch", epoch+1)
+    simulation_trace.insert(0, "epoch", epoch+1)
+    return simulation_model, simulation_trace, dataframes_params
+
+def run_simulation_fatigue(model="simon-motivation-model3", param_set=None, n_simulation=100, n_session=1, verbose=True, log=True, special_suffix="", ports=None, host="127.0.0.1", base_seed=SEED):
     """
     Run simulation for different parameters
+    If ports are given, epochs are run in parallel with one worker process per ACT-R server
 
     """
 
@@ -14,52 +70,18 @@ def run_simulation_fatigue(model="simon-motivation-model3", param_set=None, n_si
     dataframes_params = []
 
     # number of simulation per parameter sets
-    for j in range(n_simulation):
-        if verbose: print("Epoch #%03d" % j)
-
-        # number of sessions per experiment
-        dffs_model = []
-        dffs_trace = []
-        for i in range(n_session):
-            if verbose: print("\tSession #%03d" % i)
-            if i<6:
-                pass
-            else:
-                param_set["motivation"] = 10
-            print(i, param_set)
-            session = run_experiment(model,
-                                     reload=(not i),
-                                     visible=False,
-                                     verbose=True,
-                                     trace=False,
-                                     param_set=param_set)
-            session_model=session.df_stats_model_outputs()
-            session_trace=session.df_stats_trace_outputs()
-
-            # log parameter file
-            session_params = pd.Series(session.parameters)
-            session_params['file_suffix'] = str(time_suffix)
-            session_params['session'] = i+1
-
-            # log session index
-            session_model.insert(0, "session", i+1)
-            session_trace.insert(0, "session", i+1)
-
-            dffs_model.append(session_model)
-            dffs_trace.append(session_trace)
-            dataframes_params.append(session_params)
-                
-
-        simulation_model = pd.concat(dffs_model, axis=0)
-        simulation_trace = pd.concat(dffs_trace, axis=0)
-
-        # log simulation index
-        simulation_model.insert(0, "epoch", j+1)
-        simulation_trace.insert(0, "epoch", j+1)
+    epochs = [{"model": model, "param_set": param_set, "epoch": j, "n_session": n_session,
+               "verbose": verbose, "time_suffix": time_suffix, "base_seed": base_seed} for j in range(n_simulation)]
+    if ports:
+        results = map_epochs(run_fatigue_epoch, epochs, ports=ports, host=host)
+    else:
+        results = (run_fatigue_epoch(**kwargs) for kwargs in epochs)
 
+    for simulation_model, simulation_trace, session_params in results:
         # append all sessions
         dfs_model.append(simulation_model)
         dfs_trace.append(simulation_trace)
+        dataframes_params.extend(session_params)
 
 
     df_model = pd.concat(dfs_model, axis=0)
@@ -0,0 +1,190 @@
+## ================================================================ ##
+## ACTR_SERVER.PY                                                   ##
+## ================================================================ ##
+## Launches and supervises a fleet of local ACT-R servers, one port ##
+## per worker, for parallel simulations (see map_epochs() in        ##
+## simon_device.py).                                                ##
+## ================================================================ ##
+import atexit
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import time
+import actr
+
+SERVER_COMMAND_ENV = "ACTR_SERVER_COMMAND"
+
+
+class ACTRServer:
+    """A local ACT-R server process listening on one port"""
+
+    def __init__(self, command, port, host="127.0.0.1"):
+        """
+        :param command: list of arguments, "{port}" and "{host}" are replaced by the server address
+        """
+        self.command = command
+        self.port = port
+        self.host = host
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        """Start the server, unless it is already running"""
+        if self.alive():
+            return
+        # a launcher that exited may have left the Lisp server of its session behind
+        self.stop()
+        args = [arg.format(port=self.port, host=self.host) for arg in self.command]
+        env = dict(os.environ, ACTR_PORT=str(self.port), ACTR_HOST=self.host)
+        self.process = subprocess.Popen(args, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def accepting(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout=0.5):
+                return True
+        except OSError:
+            return False
+
+    def wait(self, timeout=60):
+        """Wait until the server accepts connections"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if not self.alive():
+                raise RuntimeError("ACT-R server on port %d exited with code %s" % (self.port, self.process.poll()))
+            if self.accepting():
+                return True
+            time.sleep(0.1)
+        raise TimeoutError("ACT-R server on port %d did not accept connections within %s s" % (self.port, timeout))
+
+    def signal(self, signum):
+        """Send signum to the server's process group (the launcher and the Lisp server it started)"""
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def stop(self, timeout=5):
+        if self.process is not None:
+            self.signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                pass
+            self.signal(signal.SIGKILL)
+            self.process.wait()
+        self.process = None
+
+    def __repr__(self):
+        return "<ACT-R server %s:%d [%s]>" % (self.host, self.port, "alive" if self.alive() else "stopped")
+
+
+class ACTRServerPool:
+    """
+    Launch N local ACT-R servers on distinct ports and keep them running
+
+    Example:
+        with ACTRServerPool(4, command=["run-act-r.sh", "{port}"]) as servers:
+            run_simulation(n_simulation=100, ports=servers.ports)
+    """
+
+    def __init__(self, n_servers=1, command=None, host="127.0.0.1", base_port=2650, timeout=60):
+        """
+        :param command: server command line (list or string) with a "{port}" placeholder,
+            defaults to the ACTR_SERVER_COMMAND environment variable
+        """
+        if command is None:
+            command = os.environ.get(SERVER_COMMAND_ENV)
+        if not command:
+            raise ValueError("No ACT-R server command given and %s is not set" % SERVER_COMMAND_ENV)
+        if isinstance(command, str):
+            command = shlex.split(command)
+
+        self.command = list(command)
+        self.host = host
+        self.timeout = timeout
+        self.servers = [ACTRServer(self.command, port, host) for port in self.free_ports(n_servers, base_port)]
+        self.started = False
+
+    def free_ports(self, n, base_port):
+        """Find n ports, starting at base_port, which nothing is listening on"""
+        ports = []
+        port = base_port
+        while len(ports) < n:
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.bind((self.host, port))
+                except OSError:
+                    pass
+                else:
+                    ports.append(port)
+            port += 1
+        return ports
+
+    @property
+    def ports(self):
+        return [server.port for server in self.servers]
+
+    def start(self):
+        for server in self.servers:
+            server.start()
+        if not self.started:
+            atexit.register(self.stop)
+            self.started = True
+        try:
+            for server in self.servers:
+                server.wait(self.timeout)
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def check(self):
+        """Restart any server that has died; return the restarted servers"""
+        restarted = []
+        for server in self.servers:
+            if not server.alive():
+                server.start()
+                server.wait(self.timeout)
+                server.restarts += 1
+                restarted.append(server)
+        return restarted
+
+    def connect(self, index, **kwargs):
+        """
+        Open a new ACT-R connection handle to the index-th server (restarting it if needed)
+        Use it with `with actr.use(handle):` or pass the port to actr.start() in a worker process
+        """
+        self.check()
+        server = self.servers[index]
+        handle = actr.actr(server.host, server.port, **kwargs)
+        if not handle.interface.connected:
+            raise ConnectionError("Could not connect to %r" % server)
+        handle.interface.send("set-name", "ACT-R Tutorial Python interface")
+        return handle
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+        if self.started:
+            atexit.unregister(self.stop)
+            self.started = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        return False
+
+    def __len__(self):
+        return len(self.servers)
+
+    def __repr__(self):
+        return "<ACT-R server pool %s>" % self.servers
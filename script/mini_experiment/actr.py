@@ -4,6 +4,8 @@ import socket
 import time
 import os
 import sys
+import queue
+import collections
 
 current_connection = None
 
@@ -21,15 +23,211 @@ class request():
         self.cv.release()
 
 
+class dispatcher():
+    def __init__(self,workers=4):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.active = set()
+        self.ready = queue.Queue()
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self,key,function,*args):
+        self.lock.acquire()
+        if key not in self.pending:
+            self.pending[key] = collections.deque()
+        self.pending[key].append((function,args))
+        scheduled = key in self.active
+        self.active.add(key)
+        self.lock.release()
+
+        if not scheduled:
+            self.ready.put(key)
+
+    def work(self):
+        while True:
+            key = self.ready.get()
+            if key is None:
+                return
+
+            self.lock.acquire()
+            function,args = self.pending[key].popleft()
+            self.lock.release()
+
+            try:
+                function(*args)
+            except:
+                print("Error dispatching ACT-R command",key,"with exception",sys.exc_info())
+
+            self.lock.acquire()
+            if self.pending[key]:
+                more = True
+            else:
+                more = False
+                self.active.discard(key)
+            self.lock.release()
+
+            if more:
+                self.ready.put(key)
+
+    def stop(self):
+        for worker in self.workers:
+            self.ready.put(None)
+
+
+class thread_dispatcher():
+    def submit(self,key,function,*args):
+        thread = threading.Thread(target=function,args=args)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        pass
+
+
+class json_codec():
+    def encode(self,d):
+        return json.dumps(d).encode('utf-8') + b'\x04'
+
+    def decode(self,data):
+        return json.loads(data.tobytes())
+
+
+class orjson_codec():
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+        self.options = orjson.OPT_SERIALIZE_NUMPY
+
+    def encode(self,d):
+        return self.orjson.dumps(d,default=self.default,option=self.options) + b'\x04'
+
+    def decode(self,data):
+        return self.orjson.loads(data)
+
+    def default(self,obj):
+        # numpy scalars and other objects which wrap a plain Python value
+        if hasattr(obj,'item'):
+            return obj.item()
+        raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def default_codec():
+    try:
+        return orjson_codec()
+    except ImportError:
+        return json_codec()
+
+
+class trace_sink():
+    def __init__(self,path,max_lines=10000):
+        self.file = open(path,"a")
+        self.lines = queue.Queue(max_lines)
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.write_lines)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def write(self,string):
+        try:
+            self.lines.put_nowait(string)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_lines(self):
+        while True:
+            string = self.lines.get()
+            if string == None:
+                break
+            self.file.write(string.rstrip() + "\n")
+
+    def close(self):
+        self.lines.put(None)
+        self.writer.join()
+        if self.dropped:
+            self.file.write(";;; %d trace lines dropped\n" % self.dropped)
+        self.file.close()
+
+class metadata_cache():
+    def __init__(self,handle):
+        self.handle = handle
+        self.production_names = None
+        self.chunk_names = set()
+        self.parameter_names = None
+
+    def productions(self):
+        if self.production_names is None:
+            self.production_names = set(self.handle.evaluate_single("all-productions") or [])
+        return self.production_names
+
+    def production_p(self,*names):
+        productions = self.productions()
+        return all(n in productions for n in names)
+
+    def chunk_p(self,*names):
+        unknown = [n for n in dict.fromkeys(names) if n not in self.chunk_names]
+        if unknown:
+            found = self.handle.evaluate_single_batch([("chunk-p",n) for n in unknown])
+            self.chunk_names.update(n for n,p in zip(unknown,found) if p)
+            return all(found)
+        return True
+
+    def parameters(self):
+        if self.parameter_names is None:
+            modules = self.handle.evaluate_single("modules-with-parameters") or []
+            params = self.handle.evaluate_single_batch([("modules-parameters",m) for m in modules])
+            self.parameter_names = set(str(n).lstrip(":").lower() for names in params if names for n in names)
+        return self.parameter_names
+
+    def parameter_p(self,*names):
+        parameters = self.parameters()
+        return all(n.lstrip(":").lower() in parameters for n in names)
+
+
 locals = threading.local()
 
 class actr():
     
     
-    def __init__(self,host,port):
-        self.interface = interface(host, port)
+    def __init__(self,host,port,dispatch="ordered",workers=4,recv_size=65536,codec=None,headless=False,trace_file=None):
+        self.interface = interface(host, port, dispatch, workers, recv_size, codec)
+        self.interface.handle = self
+        self.metadata = {}
+        self.model_generation = 0
         if self.interface.connected :
-            self.interface.echo_output()
+            self.interface.headless = headless
+            if trace_file:
+                self.interface.sink = trace_sink(trace_file)
+            if not(headless):
+                self.interface.echo_output()
+
+    def close(self):
+        self.interface.connected = False
+        self.interface.sock.close()
+        if self.interface.dispatcher:
+            self.interface.dispatcher.stop()
+        if self.interface.sink:
+            self.interface.sink.close()
+
+    def model_metadata(self):
+        try:
+            m = locals.model_name
+        except AttributeError:
+            m = False
+        if m not in self.metadata:
+            self.metadata[m] = metadata_cache(self)
+        return self.metadata[m]
+
+    def clear_metadata(self):
+        self.metadata = {}
+
+    def model_changed(self):
+        self.model_generation += 1
+        self.metadata = {}
 
     def evaluate (self, *params):
         
@@ -60,6 +258,40 @@ class actr():
         else:
             return False
 
+    def evaluate_batch(self,calls):
+
+        try:
+            m = locals.model_name
+        except AttributeError:
+            m = False
+
+        batch = []
+        for params in calls:
+            p = list(params)
+            p.insert(1,m)
+            batch.append(("evaluate",p))
+
+        results = []
+        for r in self.interface.send_batch(batch):
+            if r[0] == False:
+                for e in r[1:]:
+                    print (e)
+
+                results.append(False)
+            else:
+                results.append(r[1:])
+
+        return results
+
+    def evaluate_single_batch(self,calls):
+        results = []
+        for r in self.evaluate_batch(calls):
+            if r:
+                results.append(r[0])
+            else:
+                results.append(False)
+        return results
+
     def add_command(self,name,function,documentation="No documentation provided.",single=True,actr_name=None,encoded=False):
         if name in self.interface.commands.keys():
             if self.interface.commands[name] == function:
@@ -145,7 +377,7 @@ class actr():
                 return True
 
 
-def start (host=None,port=None):
+def start (host=None,port=None,dispatch="ordered",workers=4,recv_size=65536,codec=None,headless=False,trace_file=None):
 
     global current_connection
 
@@ -177,7 +409,7 @@ def start (host=None,port=None):
 
 
         try:
-            a = actr(host=host,port=port)
+            a = actr(host=host,port=port,dispatch=dispatch,workers=workers,recv_size=recv_size,codec=codec,headless=headless,trace_file=trace_file)
         except:
             print("Failed to connect to ACT-R with exception",sys.exc_info())
          
@@ -194,7 +426,14 @@ def start (host=None,port=None):
 
 def connection ():
 
-    if current_connection == None:
+    try:
+        bound = locals.connection
+    except AttributeError:
+        bound = None
+
+    if bound != None:
+        return bound
+    elif current_connection == None:
         s = start()
         if s :
             print("ACT-R connection has been started.")
@@ -204,6 +443,32 @@ def connection ():
     else:
         return current_connection
 
+class use():
+    def __init__(self,handle):
+        self.handle = handle
+
+    def __enter__(self):
+        try:
+            self.previous = locals.connection
+        except AttributeError:
+            self.previous = None
+        locals.connection = self.handle
+        return self.handle
+
+    def __exit__(self,*exc_info):
+        locals.connection = self.previous
+        return False
+
+def forget_connection():
+
+    global current_connection
+
+    current_connection = None
+    locals.connection = None
+
+if hasattr(os,'register_at_fork'):
+    os.register_at_fork(after_in_child=forget_connection)
+
 def stop():
 
     global current_connection
@@ -212,12 +477,13 @@ def stop():
         print("No current ACT-R connection to stop.")
     else:
         print("Closing down ACT-R connection.")
-        current_connection.interface.connected = False
-        current_connection.interface.sock.close()
+        current_connection.close()
         current_connection = None
 
 class interface():
-    def __init__(self,host,port):
+    def __init__(self,host,port,dispatch="ordered",workers=4,recv_size=65536,codec=None):
+        self.dispatcher = None
+        self.sink = None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
 
@@ -227,11 +493,20 @@ class interface():
             print("Error trying to connect to ACT-R at",host,":",port,"with exception",sys.exc_info())
         else:
             self.connected = True
+            self.recv_size = recv_size
+            if codec == None:
+                self.codec = default_codec()
+            else:
+                self.codec = codec
             self.cmd_id = 1
             self.actions = {}
             self.stream_lock = threading.Lock() 
             self.buffer = []
             self.commands = {}
+            if dispatch == "ordered":
+                self.dispatcher = dispatcher(workers)
+            else:
+                self.dispatcher = thread_dispatcher()
             self.data_collector = threading.Thread(target=self.collect_data)
             self.data_collector.daemon = True
             self.data_collector.start()       
@@ -239,25 +514,27 @@ class interface():
             self.echo_count = 0
             self.echo = False
             self.show_output = True
+            self.hide_count = 0
+            self.output_lock = threading.Lock()
+            self.headless = False
 
     def send(self,method,*params):
         d = {}
-        r = request(self.cmd_id)
-        self.actions[self.cmd_id] = r
-
         d['method'] = method
         self.id_lock.acquire()
+        r = request(self.cmd_id)
+        self.actions[self.cmd_id] = r
         d['id'] = self.cmd_id
         self.cmd_id += 1
         self.id_lock.release()
         d['params'] = params
         
-        message = json.dumps(d) + chr(4)
+        message = self.codec.encode(d)
         
         r.lock.acquire()
         
         self.stream_lock.acquire()
-        self.sock.sendall(message.encode('utf-8'))
+        self.sock.sendall(message)
         self.stream_lock.release()
         
         while not r.complete:
@@ -265,26 +542,64 @@ class interface():
 
         return [r.success] + r.results
 
+    def send_batch(self,calls):
+        requests = []
+        messages = []
+
+        self.id_lock.acquire()
+        for method,params in calls:
+            r = request(self.cmd_id)
+            self.actions[self.cmd_id] = r
+            d = {}
+            d['method'] = method
+            d['id'] = self.cmd_id
+            d['params'] = params
+            messages.append(self.codec.encode(d))
+            requests.append(r)
+            self.cmd_id += 1
+        self.id_lock.release()
+
+        self.stream_lock.acquire()
+        self.sock.sendall(b''.join(messages))
+        self.stream_lock.release()
+
+        results = []
+        for r in requests:
+            r.lock.acquire()
+            while not r.complete:
+                r.cv.wait()
+            r.lock.release()
+            results.append([r.success] + r.results)
+
+        return results
+
 
     def add_command(self,name,function):
         self.commands[name] = function
 
     def collect_data(self):
-        buffer= ''
+        buffer = bytearray()
+        chunk = bytearray(self.recv_size)
+        view = memoryview(chunk)
+        searched = 0
         c = True
         while c:
             try:
-                data = self.sock.recv(4096)
-                buffer += data.decode('utf-8')
-                while not chr(4) in buffer:
-                    data = self.sock.recv(4096)
-                    buffer += data.decode('utf-8')
-                while chr(4) in buffer:
-                    pos = buffer.find(chr(4))
-                    message = buffer[0:pos]
-                    pos += 1
-                    buffer = buffer[pos:]
-                    self.process_message(json.loads(message))
+                size = self.sock.recv_into(view)
+                if size == 0:
+                    raise ConnectionError("ACT-R closed the connection")
+                buffer += view[:size]
+
+                start = 0
+                pos = buffer.find(4, searched)
+                if pos >= 0:
+                    with memoryview(buffer) as frames:
+                        while pos >= 0:
+                            self.process_message(self.codec.decode(frames[start:pos]))
+                            start = pos + 1
+                            pos = buffer.find(4, start)
+                    del buffer[:start]
+                searched = len(buffer)
             except:
                 if self.connected:
                     print("ACT-R connection error connection no longer available.")
@@ -306,9 +621,7 @@ class interface():
             r.notify_result()
         else:
             if d['method'] == "evaluate" and d['params'][0] in self.commands.keys():
-                thread = threading.Thread(target=self.run_command,args=[self.commands[d['params'][0]],d['params'][0],d['params'][1],d['id'],d['params'][2:]])
-                thread.daemon = True
-                thread.start()
+                self.dispatcher.submit(d['params'][0],self.run_command,self.commands[d['params'][0]],d['params'][0],d['params'][1],d['id'],d['params'][2:])
             else:
                 f={}
                 f['id'] = d['id']
@@ -316,14 +629,15 @@ class interface():
                 e={}
                 e['message'] = "Invalid method name" + d['params'][0]
                 f['error'] = e
-                message = json.dumps(f) + chr(4)
+                message = self.codec.encode(f)
                 self.stream_lock.acquire()
-                self.sock.sendall(message.encode('utf-8'))
+                self.sock.sendall(message)
                 self.stream_lock.release()
 
     def run_command (self,command,command_name,model,id,params):
 
         locals.model_name = model
+        locals.connection = self.handle
 
         try:
             if command:
@@ -358,17 +672,43 @@ class interface():
                 f['result']= [result]
             f['error']= None
 
-        message = json.dumps(f) + chr(4)
+        message = self.codec.encode(f)
         self.stream_lock.acquire()
-        self.sock.sendall(message.encode('utf-8'))
+        self.sock.sendall(message)
         self.stream_lock.release()
         
     def output_monitor(self,string):
         if self.show_output:
-            print(string.rstrip())
+            if self.sink:
+                self.sink.write(string)
+            else:
+                print(string.rstrip())
         return True
 
+    def hide(self):
+        self.output_lock.acquire()
+        self.hide_count += 1
+        self.show_output = False
+        self.output_lock.release()
+
+    def unhide(self):
+        self.output_lock.acquire()
+        self.hide_count = max(self.hide_count - 1, 0)
+        self.show_output = (self.hide_count == 0)
+        self.output_lock.release()
+
+    def set_headless(self,headless):
+        self.headless = headless
+        if headless:
+            if self.echo:
+                self.no_output()
+        elif not(self.echo):
+            self.echo_output()
+
     def echo_output(self):
+        if self.headless:
+            print("echo_output called in headless mode.")
+            return False
         if not(self.echo): 
             if 'echo' not in self.commands.keys():
                 self.add_command("echo",self.output_monitor)
@@ -408,13 +748,12 @@ class interface():
         else:
             print("no_output called when output was already off.")
 
-current_connection = connection()
 
 def current_model():
     try:
         m = locals.model_name
     except AttributeError:
-        m = current_connection.evaluate_single('current-model')
+        m = connection().evaluate_single('current-model')
     return m
 
 def set_current_model(name):
@@ -425,208 +764,219 @@ def set_current_model(name):
 
 
 def reset ():
-    return current_connection.evaluate_single("reset")
+    r = connection().evaluate_single("reset")
+    connection().model_changed()
+    return r
 
 def reload (compile=False):
-    return current_connection.evaluate_single("reload",compile)
+    r = connection().evaluate_single("reload",compile)
+    connection().model_changed()
+    return r
 
 def run (time, real_time=False):
-    return current_connection.evaluate("run", time, real_time)
+    return connection().evaluate("run", time, real_time)
 
 def run_full_time (time, real_time=False):
-    return current_connection.evaluate("run-full-time", time, real_time)
+    return connection().evaluate("run-full-time", time, real_time)
 
 def run_until_time (time, real_time=False):
-    return current_connection.evaluate("run-until-time", time, real_time)
+    return connection().evaluate("run-until-time", time, real_time)
 
 def run_n_events (event_count, real_time=False):
-    return current_connection.evaluate("run-n-events", event_count, real_time)
+    return connection().evaluate("run-n-events", event_count, real_time)
 
 def run_until_condition(condition,real_time=False):
-    return current_connection.evaluate("run-until-condition", condition, real_time)
+    return connection().evaluate("run-until-condition", condition, real_time)
 
 def buffer_chunk (*params):
-    return current_connection.evaluate_single("buffer-chunk", *params)
+    return connection().evaluate_single("buffer-chunk", *params)
 
 def whynot (*params):
-    return current_connection.evaluate_single("whynot", *params)
+    return connection().evaluate_single("whynot", *params)
 
 def whynot_dm (*params):
-    return current_connection.evaluate_single("whynot-dm", *params)
+    return connection().evaluate_single("whynot-dm", *params)
 
 
 def penable (*params):
-    return current_connection.evaluate_single("penable", *params)
+    return connection().evaluate_single("penable", *params)
 
 def pdisable (*params):
-    return current_connection.evaluate_single("pdisable", *params)
+    return connection().evaluate_single("pdisable", *params)
 
 def load_act_r_model (path):
-    return current_connection.evaluate_single("load-act-r-model",path)
+    r = connection().evaluate_single("load-act-r-model",path)
+    connection().model_changed()
+    return r
 
 def load_act_r_code (path):
-    return current_connection.evaluate_single("load-act-r-code",path)
+    r = connection().evaluate_single("load-act-r-code",path)
+    connection().model_changed()
+    return r
+
+def model_metadata():
+    return connection().model_metadata()
 
 def goal_focus (goal=None):
-    return current_connection.evaluate_single("goal-focus",goal)
+    return connection().evaluate_single("goal-focus",goal)
 
 def clear_exp_window(win=None):
-    return current_connection.evaluate_single("clear-exp-window",win)
+    return connection().evaluate_single("clear-exp-window",win)
 
 
 def open_exp_window(title,visible=True,width=300,height=300,x=300,y=300):
-    return current_connection.evaluate_single("open-exp-window", title, [["visible", visible], ["width", width],
+    return connection().evaluate_single("open-exp-window", title, [["visible", visible], ["width", width],
                                                                          ["height", height], ["x", x], ["y", y]])
 
 def add_text_to_exp_window(window,text,x=0,y=0,color='black',height=20,width=75,font_size=12):
-    return current_connection.evaluate_single("add-text-to-exp-window", window, text,[["color", color], ["width", width],
+    return connection().evaluate_single("add-text-to-exp-window", window, text,[["color", color], ["width", width],
                                                                                       ["height", height], ["x", x], ["y", y], 
                                                                                       ["font-size", font_size]])
 
 def add_button_to_exp_window(window,text="",x=0,y=0,action=None,height=20,width=75,color='gray'):
-    return current_connection.evaluate_single("add-button-to-exp-window",window,[["color", color], ["width", width],
+    return connection().evaluate_single("add-button-to-exp-window",window,[["color", color], ["width", width],
                                                                                  ["height", height], ["x", x], ["y", y], 
                                                                                  ["text", text], ["action", action]])
 
 def remove_items_from_exp_window(window,*items):
-    return current_connection.evaluate_single("remove-items-from-exp-window",window,*items)
+    return connection().evaluate_single("remove-items-from-exp-window",window,*items)
 
 
 def install_device(device):
-    return current_connection.evaluate_single("install-device",device)
+    return connection().evaluate_single("install-device",device)
 
 def print_warning(warning):
-    current_connection.evaluate("print-warning",warning)
+    connection().evaluate("print-warning",warning)
 
 def act_r_output(output):
-    current_connection.evaluate("act-r-output",output)
+    connection().evaluate("act-r-output",output)
 
 def random(value):
-    return current_connection.evaluate_single("act-r-random",value)
+    return connection().evaluate_single("act-r-random",value)
 
 
 def add_command(name,function=None,documentation="No documentation provided.",single=True,local_name=None,encoded=False):
-    return current_connection.add_command(name,function,documentation,single,local_name,encoded)
+    return connection().add_command(name,function,documentation,single,local_name,encoded)
 
 def monitor_command(original,monitor):
-    return current_connection.monitor_command(original,monitor)
+    return connection().monitor_command(original,monitor)
  
 def remove_command_monitor(original,monitor):
-    return current_connection.remove_command_monitor(original,monitor)
+    return connection().remove_command_monitor(original,monitor)
 
 def remove_command(name):
-    return current_connection.remove_command(name)
+    return connection().remove_command(name)
 
 def print_visicon():
-    return current_connection.evaluate_single("print-visicon")
+    return connection().evaluate_single("print-visicon")
 
 def mean_deviation(results,data,output=True):
-    return current_connection.evaluate_single("mean-deviation",results,data,output)
+    return connection().evaluate_single("mean-deviation",results,data,output)
 
 def correlation(results,data,output=True):
-    return current_connection.evaluate_single("correlation",results,data,output)
+    return connection().evaluate_single("correlation",results,data,output)
 
 def get_time(model_time=True):
-    return current_connection.evaluate_single("get-time",model_time)
+    return connection().evaluate_single("get-time",model_time)
 
 def buffer_status (*params):
-    return current_connection.evaluate_single("buffer-status", *params)
+    return connection().evaluate_single("buffer-status", *params)
 
 def buffer_read (buffer):
-    return current_connection.evaluate_single("buffer-read", buffer)
+    return connection().evaluate_single("buffer-read", buffer)
 
 def clear_buffer (buffer):
-    return current_connection.evaluate_single("clear-buffer", buffer)
+    return connection().evaluate_single("clear-buffer", buffer)
 
 def new_tone_sound (freq, duration, onset=False, time_in_ms=False):
-    return current_connection.evaluate_single("new-tone-sound", freq, duration, onset, time_in_ms)
+    return connection().evaluate_single("new-tone-sound", freq, duration, onset, time_in_ms)
 
 def new_word_sound (word, onset=False, location='external', time_in_ms=False):
-    return current_connection.evaluate_single("new-word-sound", word, onset, location, time_in_ms)
+    return connection().evaluate_single("new-word-sound", word, onset, location, time_in_ms)
 
 def new_digit_sound (digit, onset=False, time_in_ms=False):
-    return current_connection.evaluate_single("new-digit-sound", digit, onset, time_in_ms)
+    return connection().evaluate_single("new-digit-sound", digit, onset, time_in_ms)
 
 def define_chunks (*chunks):
-    return current_connection.evaluate_single("define-chunks", *chunks)
+    return connection().evaluate_single("define-chunks", *chunks)
 
 def define_chunks_fct (chunks):
-    return current_connection.evaluate_single("define-chunks", *chunks)
+    return connection().evaluate_single("define-chunks", *chunks)
 
 def add_dm (*chunks):
-    return current_connection.evaluate_single("add-dm", *chunks)
+    return connection().evaluate_single("add-dm", *chunks)
 
 def add_dm_fct (chunks):
-    return current_connection.evaluate_single("add-dm-fct", chunks)
+    return connection().evaluate_single("add-dm-fct", chunks)
 
 def pprint_chunks (*chunks):
-    return current_connection.evaluate_single("pprint-chunks", *chunks)
+    return connection().evaluate_single("pprint-chunks", *chunks)
 
 def chunk_slot_value (chunk_name, slot_name):
-    return current_connection.evaluate_single("chunk-slot-value", chunk_name, slot_name)
+    return connection().evaluate_single("chunk-slot-value", chunk_name, slot_name)
 
 def set_chunk_slot_value (chunk_name, slot_name, new_value):
-    return current_connection.evaluate_single("set-chunk-slot-value", chunk_name, slot_name, new_value)
+    return connection().evaluate_single("set-chunk-slot-value", chunk_name, slot_name, new_value)
 
 def mod_chunk (chunk_name, *mods):
-    return current_connection.evaluate_single("mod-chunk", chunk_name, *mods)
+    return connection().evaluate_single("mod-chunk", chunk_name, *mods)
 
 def mod_focus (*mods):
-    return current_connection.evaluate_single("mod-focus", *mods)
+    return connection().evaluate_single("mod-focus", *mods)
 
 def chunk_p (chunk_name):
-    return current_connection.evaluate_single("chunk-p",chunk_name)
+    return connection().evaluate_single("chunk-p",chunk_name)
 
 def copy_chunk (chunk_name):
-    return current_connection.evaluate_single("copy-chunk",chunk_name)
+    return connection().evaluate_single("copy-chunk",chunk_name)
 
 def extend_possible_slots (slot_name, warn=True):
-    return current_connection.evaluate_single("extend-possible-slots",slot_name,warn)
+    return connection().evaluate_single("extend-possible-slots",slot_name,warn)
 
 def model_output (output_string):
-    return current_connection.evaluate_single("model-output",output_string)
+    return connection().evaluate_single("model-output",output_string)
 
 
 def set_buffer_chunk (buffer_name, chunk_name, requested=True):
-    return current_connection.evaluate_single("set-buffer-chunk",buffer_name,chunk_name,requested)
+    return connection().evaluate_single("set-buffer-chunk",buffer_name,chunk_name,requested)
 
 def add_line_to_exp_window (window, start, end, color = False):
     if color:
-        return current_connection.evaluate_single("add-line-to-exp-window",window,start,end,color)
+        return connection().evaluate_single("add-line-to-exp-window",window,start,end,color)
     else:
-        return current_connection.evaluate_single("add-line-to-exp-window",window,start,end)
+        return connection().evaluate_single("add-line-to-exp-window",window,start,end)
 
 def modify_line_for_exp_window (line, start, end, color = False):
     if color:
-        return current_connection.evaluate_single("modify-line-for-exp-window",line,start,end,color)
+        return connection().evaluate_single("modify-line-for-exp-window",line,start,end,color)
     else:
-        return current_connection.evaluate_single("modify-line-for-exp-window",line,start,end)
+        return connection().evaluate_single("modify-line-for-exp-window",line,start,end)
 
 def start_hand_at_mouse ():
-    return current_connection.evaluate_single("start-hand-at-mouse")
+    return connection().evaluate_single("start-hand-at-mouse")
 
 def schedule_event (time, action, params=None, module=':NONE', priority=0, maintenance=False, destination=None, details=None,output=True,time_in_ms=False,precondition=None):
-    return current_connection.evaluate_single("schedule-event",time,action,[["params", params],["module", module],
+    return connection().evaluate_single("schedule-event",time,action,[["params", params],["module", module],
                                                                             ["priority", priority],["maintenance", maintenance],
                                                                             ["destination", destination], ["details", details],
                                                                             ["output", output],["time-in-ms", time_in_ms],
                                                                             ["precondition", precondition]])
 
 def schedule_event_now (action, params=None, module=':NONE', priority=0, maintenance=False, destination=None, details=None,output=True,precondition=None):
-    return current_connection.evaluate_single("schedule-event-now",action,[["params", params],["module", module],
+    return connection().evaluate_single("schedule-event-now",action,[["params", params],["module", module],
                                                                                    ["priority", priority],["maintenance", maintenance],
                                                                                    ["destination", destination], ["details", details],
                                                                                    ["output", output], ["precondition", precondition]])
 
 def schedule_event_relative (time_delay, action, params=None, module=':NONE', priority=0, maintenance=False, destination=None, details=None,output=True,time_in_ms=False,precondition=None):
-    return current_connection.evaluate_single("schedule-event-relative",time_delay,action,[["params", params],["module", module],
+    return connection().evaluate_single("schedule-event-relative",time_delay,action,[["params", params],["module", module],
                                                                         ["priority", priority],["maintenance", maintenance],
                                                                         ["destination", destination], ["details", details],
                                                                         ["output", output],["time-in-ms", time_in_ms],
                                                                         ["precondition", precondition]])
 
 def schedule_event_after_module (after_module, action, params=None, module=':NONE', maintenance=False, destination=None, details=None, output=True, precondition=None, dynamic=False, delay=True, include_maintenance=False):
-    return current_connection.evaluate("schedule-event-after-module",after_module,action,[["params", params],["module", module],
+    return connection().evaluate("schedule-event-after-module",after_module,action,[["params", params],["module", module],
                                                                         ["maintenance", maintenance],
                                                                         ["destination", destination], ["details", details],
                                                                         ["output", output],["delay", delay], ["dynamic", dynamic],
@@ -634,228 +984,274 @@ def schedule_event_after_module (after_module, action, params=None, module=':NON
 
 
 def schedule_break_relative (time_delay,time_in_ms=False, priority=":max", details=None):
-    return current_connection.evaluate_single("schedule-break-relative",time_delay,[["time-in-ms", time_in_ms],["priority", priority],["details",details]])
+    return connection().evaluate_single("schedule-break-relative",time_delay,[["time-in-ms", time_in_ms],["priority", priority],["details",details]])
 
 def mp_show_queue(indicate_traced=False):
-    return current_connection.evaluate_single("mp-show-queue",indicate_traced)
+    return connection().evaluate_single("mp-show-queue",indicate_traced)
 
 def print_dm_finsts():
-    return current_connection.evaluate_single("print-dm-finsts")
+    return connection().evaluate_single("print-dm-finsts")
 
 def spp (*params):
-    return current_connection.evaluate_single("spp", *params)
+    return connection().evaluate_single("spp", *params)
 
 def mp_models():
-    return current_connection.evaluate_single("mp-models")
+    return connection().evaluate_single("mp-models")
 
 def all_productions():
-    return current_connection.evaluate_single("all-productions")
+    return connection().evaluate_single("all-productions")
 
 def buffers():
-    return current_connection.evaluate_single("buffers")
+    return connection().evaluate_single("buffers")
 
 def printed_visicon():
-    return current_connection.evaluate_single("printed-visicon")
+    return connection().evaluate_single("printed-visicon")
 
 def print_audicon():
-    return current_connection.evaluate_single("print-audicon")
+    return connection().evaluate_single("print-audicon")
 
 def printed_audicon():
-    return current_connection.evaluate_single("printed-audicon")
+    return connection().evaluate_single("printed-audicon")
 
 def printed_parameter_details(param):
-    return current_connection.evaluate_single("printed-parameter-details",param)
+    return connection().evaluate_single("printed-parameter-details",param)
 
 def sorted_module_names():
-    return current_connection.evaluate_single("sorted-module-names")
+    return connection().evaluate_single("sorted-module-names")
 
 def modules_parameters(module):
-    return current_connection.evaluate_single("modules-parameters",module)
+    return connection().evaluate_single("modules-parameters",module)
 
 def modules_with_parameters():
-    return current_connection.evaluate_single("modules-with-parameters")
+    return connection().evaluate_single("modules-with-parameters")
 
 def used_production_buffers():
-    return current_connection.evaluate_single("used-production-buffers")
+    return connection().evaluate_single("used-production-buffers")
 
 def record_history(*params):
-    return current_connection.evaluate_single("record-history",*params)
+    return connection().evaluate_single("record-history",*params)
 
 def stop_recording_history(*params):
-    return current_connection.evaluate_single("stop-recording-history",*params)
+    return connection().evaluate_single("stop-recording-history",*params)
 
 def get_history_data(history,*params):
-    return current_connection.evaluate_single("get-history-data",history,*params)
+    return connection().evaluate_single("get-history-data",history,*params)
 
 def history_data_available(history,file=False,*params):
-    return current_connection.evaluate_single("history-data-available",history,file,*params)
+    return connection().evaluate_single("history-data-available",history,file,*params)
 
 def process_history_data(processor,file=False,data_params=None,processor_params=None):
-    return current_connection.evaluate_single("process-history-data",processor,file,data_params,processor_params)
+    return connection().evaluate_single("process-history-data",processor,file,data_params,processor_params)
 
 def save_history_data(history,file,comment="",*params):
-    return current_connection.evaluate_single("save-history-data",history,file,comment,*params)
+    return connection().evaluate_single("save-history-data",history,file,comment,*params)
 
 
 def dm (*params):
-    return current_connection.evaluate_single("dm", *params)
+    return connection().evaluate_single("dm", *params)
 
 def sdm (*params):
-    return current_connection.evaluate_single("sdm", *params)
+    return connection().evaluate_single("sdm", *params)
 
 
 def get_parameter_value(param):
-    return current_connection.evaluate_single("get-parameter-value",param)
+    return connection().evaluate_single("get-parameter-value",param)
 
 def set_parameter_value(param,value):
-    return current_connection.evaluate_single("set-parameter-value",param,value)
+    return connection().evaluate_single("set-parameter-value",param,value)
+
+def get_parameter_values(*params):
+    values = connection().evaluate_single_batch([("get-parameter-value",p) for p in params])
+    return dict(zip(params,values))
+
+def set_parameter_values(mapping):
+    mapping = dict(mapping)
+    values = connection().evaluate_single_batch([("set-parameter-value",p,v) for p,v in mapping.items()])
+    return dict(zip(mapping,values))
 
 
 def get_system_parameter_value(param):
-    return current_connection.evaluate_single("get-system-parameter-value",param)
+    return connection().evaluate_single("get-system-parameter-value",param)
 
 def set_system_parameter_value(param,value):
-    return current_connection.evaluate_single("set-system-parameter-value",param,value)
+    return connection().evaluate_single("set-system-parameter-value",param,value)
 
 
 def sdp (*params):
-    return current_connection.evaluate_single("sdp", *params)
+    return connection().evaluate_single("sdp", *params)
+
+def parameter_tables(*requests):
+    calls = []
+    for command,names,params in requests:
+        calls.extend([(command,name) + tuple(params) for name in names])
+    results = iter(connection().evaluate_single_batch(calls))
+    tables = []
+    for command,names,params in requests:
+        table = []
+        for name in names:
+            r = next(results)
+            values = r[0] if r and r[0] is not None else [None] * len(params)
+            table.extend(zip([name] * len(params),params,values))
+        tables.append(table)
+    return tables
+
+def spp_table(productions,*params):
+    return parameter_tables(("spp",productions,params))[0]
+
+def sdp_table(chunks,*params):
+    return parameter_tables(("sdp",chunks,params))[0]
 
 
 def simulate_retrieval_request (*spec):
-    return current_connection.evaluate_single("simulate-retrieval-request", *spec)
+    return connection().evaluate_single("simulate-retrieval-request", *spec)
 
 def saved_activation_history ():
-    return current_connection.evaluate_single("saved-activation-history")
+    return connection().evaluate_single("saved-activation-history")
 
 def print_activation_trace (time, ms = True):
-    return current_connection.evaluate_single("print-activation-trace",time,ms)
+    return connection().evaluate_single("print-activation-trace",time,ms)
 
 def print_chunk_activation_trace (chunk, time, ms = True):
-    return current_connection.evaluate_single("print-chunk-activation-trace",chunk,time,ms)
+    return connection().evaluate_single("print-chunk-activation-trace",chunk,time,ms)
 
 def pp (*params):
-    return current_connection.evaluate_single("pp", *params)
+    return connection().evaluate_single("pp", *params)
 
 def trigger_reward(reward,maintenance=False):
-    return current_connection.evaluate_single("trigger-reward",reward,maintenance)
+    return connection().evaluate_single("trigger-reward",reward,maintenance)
 
 
 def define_chunk_spec (*spec):
-    return current_connection.evaluate_single("define-chunk-spec", *spec)
+    return connection().evaluate_single("define-chunk-spec", *spec)
 
 def chunk_spec_to_chunk_def(spec_id):
-    return current_connection.evaluate_single("chunk-spec-to-chunk-def", spec_id)
+    return connection().evaluate_single("chunk-spec-to-chunk-def", spec_id)
 
 def release_chunk_spec(spec_id):
-    return current_connection.evaluate_single("release-chunk-spec-id", spec_id)
+    return connection().evaluate_single("release-chunk-spec-id", spec_id)
    
 
 
 def schedule_simple_set_buffer_chunk (buffer, chunk, time, module='NONE', priority=0, requested=True):
-    return current_connection.evaluate_single("schedule-simple-set-buffer-chunk",buffer,chunk,time,module,priority,requested)
+    return connection().evaluate_single("schedule-simple-set-buffer-chunk",buffer,chunk,time,module,priority,requested)
 
 def schedule_simple_mod_buffer_chunk (buffer, mod_list_or_spec, time, module='NONE', priority=0):
-    return current_connection.evaluate_single("schedule-simple-mod-buffer-chunk",buffer,mod_list_or_spec,time,module,priority)
+    return connection().evaluate_single("schedule-simple-mod-buffer-chunk",buffer,mod_list_or_spec,time,module,priority)
 
 
 def schedule_set_buffer_chunk (buffer, chunk, time, module=':NONE', priority=0, output='low',time_in_ms=False,requested=True):
-    return current_connection.evaluate_single("schedule-set-buffer-chunk",buffer,chunk,time,[["module", module],
+    return connection().evaluate_single("schedule-set-buffer-chunk",buffer,chunk,time,[["module", module],
                                                                         ["priority", priority],["output", output],["time-in-ms", time_in_ms],
                                                                         ["requested", requested]])
 
 def schedule_mod_buffer_chunk (buffer, mod_list_or_spec, time, module=':NONE', priority=0, output='low',time_in_ms=False):
-    return current_connection.evaluate_single("schedule-mod-buffer-chunk",buffer,mod_list_or_spec,time,[["module", module],
+    return connection().evaluate_single("schedule-mod-buffer-chunk",buffer,mod_list_or_spec,time,[["module", module],
                                                                         ["priority", priority],["output", output],["time-in-ms", time_in_ms]])
 
 
 def undefine_module(name):
-    return current_connection.evaluate_single("undefine-module", name)
+    return connection().evaluate_single("undefine-module", name)
 
 
 def delete_chunk(name):
-    return current_connection.evaluate_single("delete-chunk", name)
+    return connection().evaluate_single("delete-chunk", name)
 
 def purge_chunk(name):
-    return current_connection.evaluate_single("purge-chunk", name)
+    return connection().evaluate_single("purge-chunk", name)
 
 
 
 def define_module (name, buffers,params,interface=None):
-    return current_connection.evaluate_single("define-module", name, buffers, params, interface)
+    return connection().evaluate_single("define-module", name, buffers, params, interface)
 
 
 def command_output(string):
-    return current_connection.evaluate_single("command-output",string)
+    return connection().evaluate_single("command-output",string)
 
 def chunk_copied_from(chunk_name):
-    return current_connection.evaluate_single("chunk-copied-from",chunk_name)
+    return connection().evaluate_single("chunk-copied-from",chunk_name)
 
 
 def mp_time ():
-    return current_connection.evaluate_single("mp-time")
+    return connection().evaluate_single("mp-time")
 
 def mp_time_ms ():
-    return current_connection.evaluate_single("mp-time-ms")
+    return connection().evaluate_single("mp-time-ms")
 
 def predict_bold_response(start=None,end=None,output=None):
     if start == None:
-        return current_connection.evaluate_single("predict-bold-response")
+        return connection().evaluate_single("predict-bold-response")
     elif end == None:
-        return current_connection.evaluate_single("predict-bold-response", start)
+        return connection().evaluate_single("predict-bold-response", start)
     elif output == None:
-        return current_connection.evaluate_single("predict-bold-response", start, end)
+        return connection().evaluate_single("predict-bold-response", start, end)
     else:
-        return current_connection.evaluate_single("predict-bold-response", start, end, output)
+        return connection().evaluate_single("predict-bold-response", start, end, output)
 
 def pbreak (*params):
-    return current_connection.evaluate_single("pbreak", *params)
+    return connection().evaluate_single("pbreak", *params)
 
 def punbreak (*params):
-    return current_connection.evaluate_single("punbreak", *params)
+    return connection().evaluate_single("punbreak", *params)
 
 def create_image_for_exp_window(window,text,file,x=0,y=0,width=50,height=50,action=None):
-    return current_connection.evaluate_single("create-image-for-exp-window", window, text, file,
+    return connection().evaluate_single("create-image-for-exp-window", window, text, file,
                                               [['x', x],['y', y],['width', width],['height', height],['action', action]])
 
 def add_image_to_exp_window(window,text,file,x=0,y=0,width=50,height=50,action=None):
-    return current_connection.evaluate_single("add-image-to-exp-window", window, text, file,
+    return connection().evaluate_single("add-image-to-exp-window", window, text, file,
                                               [['x', x],['y', y],['width', width],['height', height],['action', action]])
 
 def add_items_to_exp_window(window, *items):
-    return current_connection.evaluate_single("add-items-to-exp-window",window, *items)
+    return connection().evaluate_single("add-items-to-exp-window",window, *items)
 
 
 def add_visicon_features(*features):
-    return current_connection.evaluate_single("add-visicon-features",*features)
+    return connection().evaluate_single("add-visicon-features",*features)
 
 def delete_visicon_features(*features):
-    return current_connection.evaluate_single("delete-visicon-features",*features)
+    return connection().evaluate_single("delete-visicon-features",*features)
 
 def delete_all_visicon_features():
-    return current_connection.evaluate_single("delete-all-visicon-features")
+    return connection().evaluate_single("delete-all-visicon-features")
 
 def modify_visicon_features(*features):
-    return current_connection.evaluate_single("modify-visicon-features",*features)
+    return connection().evaluate_single("modify-visicon-features",*features)
 
 def running():
-    return current_connection.evaluate_single("act-r-running-p")
+    return connection().evaluate_single("act-r-running-p")
 
 
 def stop_output():
-    current_connection.interface.no_output()
+    connection().interface.no_output()
 
 def resume_output():
-    current_connection.interface.echo_output()
+    connection().interface.echo_output()
 
 def hide_output():
-    current_connection.interface.show_output = False
+    connection().interface.hide()
 
 def unhide_output():
-    current_connection.interface.show_output = True
+    connection().interface.unhide()
+
+class suppress_output():
+    def __init__(self,handle=None):
+        self.handle = handle
+
+    def __enter__(self):
+        self.interface = (self.handle or connection()).interface
+        self.interface.hide()
+        return self.interface
+
+    def __exit__(self,*exc_info):
+        self.interface.unhide()
+        return False
+
+def set_headless(headless=True):
+    connection().interface.set_headless(headless)
 
 def visible_virtuals_available():
-    return current_connection.evaluate_single("visible-virtuals-available?")
+    return connection().evaluate_single("visible-virtuals-available?")
 
 def process_events():
     time.sleep(0)
@@ -863,11 +1259,14 @@ def process_events():
 def permute_list(l):
 
     indexes = list(range(len(l)))
-    new_indexes = current_connection.evaluate_single("permute-list",indexes)
+    new_indexes = connection().evaluate_single("permute-list",indexes)
     result = []
     for i in new_indexes:
         result.append(l[i])
     return result
 
 def call_command(command,*parameters):
-    return current_connection.evaluate_single(command,*parameters)
\ No newline at end of file
+    return connection().evaluate_single(command,*parameters)
+
+def call_commands(*calls):
+    return connection().evaluate_single_batch(calls)
\ No newline at end of file
@@ -56,7 +56,6 @@ class MiniModel:
             return x
         
     def setup_parameters(self):
-        actr.hide_output()
         # set at parameter
         
         # set difficulty level
@@ -71,10 +70,10 @@ class MiniModel:
         #self.production_reward = [self.payoff_function(x, x0=x0, l=l) for x in self.production_reward]
         self.production_reward = [self.payoff_function(x, x0=l/2, l=l) for x in self.production_reward]
         
-        for i in range(len(self.ordered_productions)):
-            actr.spp(self.ordered_productions[i], ":at", self.production_at[i], ":reward", self.production_reward[i])
+        with actr.suppress_output():
+            for i in range(len(self.ordered_productions)):
+                actr.spp(self.ordered_productions[i], ":at", self.production_at[i], ":reward", self.production_reward[i])
         #actr.spp("DONE", ":reward", 1)
-        actr.unhide_output() 
         
 
     def production_hook(self, *params):
@@ -115,17 +114,14 @@ class MiniModel:
         """
         This function will extract the parameter value of a production during model running
         """
-        #assert (production_name in actr.all_productions() and
-        #        parameter_name in [':u', ':utility', ':at', ':reward', ':fixed-utility'])
-        utility_trace = []
-        actr.hide_output()
-        for production_name in self.ordered_productions:
-            u = actr.spp(production_name, ":u")[0][0]
-            utility = actr.spp(production_name, ":utility")[0][0]
-            reward = actr.spp(production_name, ":reward")[0][0]
-            utility_trace.append((epoch, production_name, u, utility, reward))
-        actr.unhide_output()
-        return pd.DataFrame(utility_trace, columns=['epoch','production', 'u', 'utility', 'delivered_reward'])
+        assert actr.model_metadata().production_p(*self.ordered_productions)
+        with actr.suppress_output():
+            table = actr.spp_table(self.ordered_productions, ":u", ":utility", ":reward")
+        df = pd.DataFrame(table, columns=['production', 'parameter', 'value'])
+        df = df.pivot(index='production', columns='parameter', values='value').reindex(self.ordered_productions)
+        df = df.rename(columns={':u': 'u', ':utility': 'utility', ':reward': 'delivered_reward'}).rename_axis(columns=None).reset_index()
+        df.insert(0, 'epoch', epoch)
+        return df[['epoch', 'production', 'u', 'utility', 'delivered_reward']]
     
     def df_trace_output(self):
         df_trial_trace = pd.DataFrame(self.trial_trace, columns=['trial', 'production', 'response_time'])
@@ -0,0 +1,111 @@
+## ================================================================ ##
+## RESULT_CACHE.PY                                                  ##
+## ================================================================ ##
+## Content-addressed cache of simulation results. An entry is keyed ##
+## by a hash of the model source files and of everything else that ##
+## determines the result (parameters, number of trials, seeds, ...) ##
+## so editing a .lisp file invalidates its entries automatically.   ##
+## The least recently used entries are evicted beyond max_bytes.    ##
+## ================================================================ ##
+import glob
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from sweep import canonical_value
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def canonical(value):
+    """JSON-able canonical form of a key value: dict keys sorted, numbers canonicalized"""
+    if isinstance(value, dict):
+        return {str(k): canonical(v) for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if value is None or isinstance(value, str):
+        return value
+    return canonical_value(value)
+
+
+def cache_key(sources, **spec):
+    """
+    Hash of the contents of the source files and of the canonical spec
+    :param sources: model files, only their contents (not their paths) enter the key
+    """
+    key = {"sources": [file_digest(path) for path in sources], "spec": canonical(spec)}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded on-disk cache of pickled results
+
+    Example:
+        cache = ResultCache("../data/cache")
+        key = cache_key(model_files(model), param_set=param_set, epoch=0)
+        result = cache.get(key)
+        if result is None:
+            result = cache.put(key, run_epoch(model, param_set, epoch=0))
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def entry(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def __contains__(self, key):
+        return os.path.exists(self.entry(key))
+
+    def get(self, key, default=None):
+        """Cached result of key, or default; a hit marks the entry as recently used"""
+        path = self.entry(key)
+        try:
+            with open(path, "rb") as f:
+                result = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        """Store result under key and evict old entries if needed; return result"""
+        tmp = os.path.join(self.path, ".%s.%s.tmp" % (key, uuid.uuid4().hex))
+        with open(tmp, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+        return result
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for path in glob.glob(os.path.join(self.path, "*.pkl")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        size = sum(e[1] for e in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.path, "*.pkl")):
+            os.remove(path)
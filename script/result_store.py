@@ -0,0 +1,231 @@
+## ================================================================ ##
+## RESULT_STORE.PY                                                  ##
+## ================================================================ ##
+## Partitioned, columnar store for simulation results written by    ##
+## save_simulation() and read by load_simulation() (simon_device).  ##
+## Each append writes new files under                               ##
+##   <root>/<name>/<table>/motivation=../init_cost=../              ##
+##       update_cost=../valid_cue_percentage=../date=yymmdd/        ##
+## so concurrent writers never touch the same file. Files are       ##
+## Parquet when pyarrow is installed, CSV otherwise.                ##
+## ================================================================ ##
+import glob
+import os
+import uuid
+from datetime import datetime
+import pandas as pd
+from sweep import SWEEP_PARAMETERS, canonical_value
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARTITION_KEYS = SWEEP_PARAMETERS + ("date",)
+
+# explicit column types of the model output (see SimonTask.df_stats_model_outputs() and run_epoch())
+# other columns keep the type pandas gives them
+MODEL_OUTPUT_DTYPES = {"epoch": "int32", "session": "int32", "index": "int32",
+                       "onset_time": "float64", "accuracy": "float32", "pre_trial_accuracy": "category",
+                       "response_time": "float32", "condition_stimulus": "category", "condition_cue": "category",
+                       "stimulus_shape": "category", "stimulus_location": "category",
+                       "check_count": "int32", "check_time": "float32", "motivation": "float64", "cost": "float32",
+                       "rewarded_time": "float64", "production": "category", "delivered_reward": "float32",
+                       "passed_time": "float32", "received_reward": "float32",
+                       "u_check": "float32", "u_dont_check": "float32"}
+
+# explicit column types of the parameter log (see SimonTask.parameters and run_epoch())
+# parameters are floats in every file, whether a run set them as 1, 0.5, False or nil, so the files merge on read
+LOG_DTYPES = {"seed": "str", "session": "int32", "n_trials": "int32",
+              "motivation": "float64", "init_cost": "float64", "update_cost": "float64", "valid_cue_percentage": "float64",
+              "ans": "float64", "le": "float64", "lf": "float64", "mas": "float64", "bll": "float64", "egs": "float64",
+              "alpha": "float64", "imaginal-activation": "float64", "dat": "float64"}
+
+
+def arrow_type(dtype):
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    if dtype == "str":
+        return pa.string()
+    return pa.from_numpy_dtype(dtype)
+
+
+def arrow_table(df, dtypes):
+    """Convert a DataFrame to an Arrow table, using dtypes for the columns it names"""
+    df = with_dtypes(df, dtypes)
+    arrays = []
+    for name in df.columns:
+        if name in dtypes:
+            arrays.append(pa.array(df[name].to_numpy(), type=arrow_type(dtypes[name]), from_pandas=True))
+        else:
+            arrays.append(pa.Table.from_pandas(df[[name]], preserve_index=False).column(0))
+    return pa.Table.from_arrays(arrays, names=[str(name) for name in df.columns])
+
+
+def with_dtypes(df, dtypes):
+    return df.astype({name: (str if dtype == "str" else dtype) for name, dtype in dtypes.items() if name in df.columns})
+
+
+def unified_schema(files):
+    """Schema of all files; files written before LOG_DTYPES may disagree on int vs float, which is widened"""
+    schemas = [pq.read_schema(f) for f in files]
+    try:
+        return pa.unify_schemas(schemas, promote_options="permissive")
+    except TypeError:
+        # pyarrow < 14 only merges identical types
+        return pa.unify_schemas(schemas)
+
+
+def as_values(value):
+    return value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+
+
+class ResultStore:
+    """
+    Append-only store of (model output, parameter log) pairs, partitioned by parameter set and date
+
+    Example:
+        store = ResultStore("../data", "simulation")
+        store.append(df_model, df_param)
+        df_model, df_param = store.load(columns=["epoch", "accuracy", "response_time"],
+                                        filters={"motivation": [1, 2], "init_cost": 0.05})
+    """
+
+    def __init__(self, root, name, use_arrow=None):
+        """
+        :param use_arrow: write Parquet files (default: when pyarrow is installed)
+        """
+        self.path = os.path.join(root, name)
+        self.use_arrow = (pa is not None) if use_arrow is None else use_arrow
+        if self.use_arrow and pa is None:
+            raise ImportError("pyarrow is required to write Parquet files")
+
+    def exists(self):
+        return os.path.isdir(os.path.join(self.path, "model_output"))
+
+    def partition(self, df_param, date=None):
+        """Partition directory of a parameter log, e.g. motivation=1.0/init_cost=0.05/.../date=221018"""
+        values = df_param.iloc[0] if len(df_param) else {}
+        parts = ["%s=%s" % (name, canonical_value(values[name]) if name in values else "NA") for name in SWEEP_PARAMETERS]
+        parts.append("date=%s" % (date or datetime.now().strftime("%y%m%d")))
+        return os.path.join(*parts)
+
+    def write(self, table, partition, df, dtypes):
+        directory = os.path.join(self.path, table, partition)
+        os.makedirs(directory, exist_ok=True)
+        name = "part-%s" % uuid.uuid4().hex
+        extension = ".parquet" if self.use_arrow else ".csv"
+
+        # written under a hidden name first, readers only see complete files
+        tmp = os.path.join(directory, "." + name + ".tmp")
+        if self.use_arrow:
+            pq.write_table(arrow_table(df, dtypes), tmp)
+        else:
+            df.to_csv(tmp, index=False)
+        os.replace(tmp, os.path.join(directory, name + extension))
+
+    def partitions(self, df, date=None):
+        """Partition directory of every row of df"""
+        labels = pd.Series("", index=df.index)
+        for name in SWEEP_PARAMETERS:
+            values = df[name].map(canonical_value) if name in df.columns else "NA"
+            labels = labels + name + "=" + values + os.sep
+        return labels + "date=%s" % (date or datetime.now().strftime("%y%m%d"))
+
+    def append(self, df_model, df_param, date=None):
+        """
+        Write one epoch (or any batch) of results as new files
+        A batch mixing parameter sets is written as one pair of files per partition; df_model then
+        needs the SWEEP_PARAMETERS columns which differ between them
+        """
+        labels = self.partitions(df_param, date)
+        if labels.nunique() <= 1:
+            partition = self.partition(df_param, date)
+            self.write("model_output", partition, df_model, MODEL_OUTPUT_DTYPES)
+            self.write("log", partition, df_param, LOG_DTYPES)
+            return
+
+        varying = [name for name in SWEEP_PARAMETERS if name in df_param.columns and df_param[name].map(canonical_value).nunique() > 1]
+        missing = [name for name in varying if name not in df_model.columns]
+        if missing:
+            raise ValueError("df_param mixes parameter sets but df_model has no %s column to split it by" % missing)
+        keys = [df[varying].map(canonical_value).agg("/".join, axis=1) for df in (df_param, df_model)]
+        model_labels = keys[1].map(dict(zip(keys[0], labels)))
+        if model_labels.isna().any():
+            raise ValueError("df_model has rows of parameter sets which are not in df_param")
+        for partition in labels.unique():
+            self.write("model_output", partition, df_model[model_labels == partition], MODEL_OUTPUT_DTYPES)
+            self.write("log", partition, df_param[labels == partition], LOG_DTYPES)
+
+    def files(self, table, filters=None):
+        """Files of a table, skipping partitions excluded by filters on PARTITION_KEYS"""
+        allowed = {name: set(canonical_value(v) for v in as_values(value))
+                   for name, value in (filters or {}).items() if name in PARTITION_KEYS}
+        files = []
+        for path in sorted(glob.glob(os.path.join(self.path, table, "**", "part-*"), recursive=True)):
+            keys = dict(part.split("=", 1) for part in os.path.relpath(os.path.dirname(path), os.path.join(self.path, table)).split(os.sep) if "=" in part)
+            if all(keys.get(name) in values for name, values in allowed.items()):
+                files.append(path)
+        return files
+
+    def read(self, table, files, columns=None, filters=None, dtypes=None):
+        dtypes = dtypes or {}
+        filters = {name: value for name, value in (filters or {}).items() if name not in PARTITION_KEYS}
+        if not files:
+            return pd.DataFrame(columns=columns)
+
+        if all(f.endswith(".parquet") for f in files):
+            dataset = ds.dataset(files, format="parquet", schema=unified_schema(files))
+            names = dataset.schema.names
+            expression = None
+            for name, value in filters.items():
+                if name in names:
+                    condition = ds.field(name).isin(list(as_values(value)))
+                    expression = condition if expression is None else expression & condition
+            projection = [c for c in columns if c in names] if columns else None
+            return dataset.to_table(columns=projection, filter=expression).to_pandas()
+
+        if pa is not None:
+            frames = [pq.read_table(f).to_pandas() if f.endswith(".parquet") else pd.read_csv(f) for f in files]
+        else:
+            frames = [pd.read_csv(f) for f in files]
+        df = with_dtypes(pd.concat(frames, axis=0, ignore_index=True), dtypes)
+        for name, value in filters.items():
+            if name in df.columns:
+                df = df[df[name].isin(list(as_values(value)))]
+        if columns:
+            df = df[[c for c in columns if c in df.columns]]
+        return df.reset_index(drop=True)
+
+    def load(self, columns=None, filters=None):
+        """
+        Read the stored results
+        :param columns: model output columns to read (default: all)
+        :param filters: dict of column -> value or list of values, e.g. {"motivation": [1, 2], "init_cost": 0.05};
+            parameters in PARTITION_KEYS skip whole partitions, other columns are filtered row by row
+        Return: (df_model, df_param)
+        """
+        df_model = self.read("model_output", self.files("model_output", filters), columns, filters, MODEL_OUTPUT_DTYPES)
+        df_param = self.read("log", self.files("log", filters), None, filters, LOG_DTYPES)
+        return df_model, df_param
+
+
+if __name__ == "__main__":
+    # round trip of two batches whose parameters differ in type (motivation 1 vs 0.5, update_cost False vs 0.1)
+    import tempfile
+    with tempfile.TemporaryDirectory() as root:
+        for use_arrow in ([True, False] if pa is not None else [False]):
+            store = ResultStore(root, "check-%s" % use_arrow, use_arrow=use_arrow)
+            for motivation, update_cost in ((1, False), (0.5, 0.1)):
+                df_model = pd.DataFrame({"epoch": [1, 1], "session": [1, 1], "index": [0, 1], "accuracy": [1.0, 0.0]})
+                df_param = pd.DataFrame({"seed": ["[1, 0]"], "session": [1], "motivation": [motivation], "init_cost": [0.05],
+                                         "update_cost": [update_cost], "valid_cue_percentage": [0.8], "ans": [None]})
+                store.append(df_model, df_param)
+            df_model, df_param = store.load()
+            assert len(df_model) == 4 and len(df_param) == 2
+            assert sorted(df_param["motivation"]) == [0.5, 1.0] and df_param["motivation"].dtype == "float64"
+            df_model, df_param = store.load(filters={"motivation": 1})
+            assert len(df_model) == 2 and list(df_param["motivation"]) == [1.0]
+    print("result_store: ok")
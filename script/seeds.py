@@ -0,0 +1,46 @@
+## ================================================================ ##
+## SEEDS.PY                                                         ##
+## ================================================================ ##
+## Reproducible seed streams for simulations. Every seed is derived ##
+## by hashing (base seed, parameter set, epoch, session, purpose),  ##
+## so a session gets the same stimulus order and ACT-R :seed no     ##
+## matter which worker runs it or in which order cells are run.     ##
+## ================================================================ ##
+import hashlib
+import json
+from result_cache import canonical
+
+SEED_BITS = 31
+
+
+def param_hash(param_set):
+    """Short hash of a canonicalized parameter set"""
+    data = json.dumps(canonical(dict(param_set or {})), sort_keys=True).encode()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def derive_seed(base_seed, *path):
+    """An integer in [0, 2**SEED_BITS) determined by base_seed and path"""
+    data = json.dumps([canonical(base_seed)] + [canonical(p) for p in path]).encode()
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], "big") % (1 << SEED_BITS)
+
+
+class SeedStream:
+    """
+    Independent seeds for the sessions of one parameter set
+
+    Example:
+        stream = SeedStream(100, param_set)
+        stimulus_seed, actr_seed = stream.session_seeds(epoch=0, session=0)
+    """
+
+    def __init__(self, base_seed, param_set=None):
+        self.base_seed = base_seed
+        self.param_hash = param_hash(param_set)
+
+    def seed(self, purpose, epoch=0, session=0):
+        return derive_seed(self.base_seed, self.param_hash, epoch, session, purpose)
+
+    def session_seeds(self, epoch=0, session=0):
+        """Return: (stimulus_seed, actr_seed)"""
+        return self.seed("stimuli", epoch, session), self.seed("act-r", epoch, session)
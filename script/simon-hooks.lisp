@@ -0,0 +1,123 @@
+;;; ================================================================
+;;; SIMON TASK MODEL - LISP-SIDE HOOKS
+;;; ================================================================
+;;; (c) 2022, Cher Yang, University of Washington
+;;;           chery@uw.edu
+;;; ================================================================
+;;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;;;
+;;; Filename    :simon-hooks.lisp
+;;; Version     :v1.0
+;;;
+;;; Description :Helpers loaded with load-act-r-code after simon-core.lisp,
+;;;              simon-base.lisp and the motivation model. They run inside
+;;;              ACT-R, so the Python device (simon_device.py) receives one
+;;;              message where it used to send many requests, and events
+;;;              the device ignores never leave ACT-R.
+;;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+;;;
+;;; Public API:
+;;;
+;;; simon-trace-configure (productions chunks end-production)
+;;;    Sets the productions whose :u is recorded, the chunks whose
+;;;    :last-retrieval-activation is recorded, and the production that
+;;;    ends a trial.
+;;;
+;;; simon-trace-cycle-hook (production)
+;;;    Cycle hook. When the trial-ending production fires, calls the
+;;;    Python command "simon-trial-trace" with
+;;;      (utilities activations cost)
+;;;    where cost is the :at of the first recorded production.
+;;;
+;;; simon-filter-configure (productions rewards buffered immediate)
+;;;    Sets the productions whose firing is sent to "detect-production-hook"
+;;;    and whose rewards are sent to "detect-reward-hook". When buffered is
+;;;    true the events are kept until simon-filter-flush, except for the
+;;;    productions in immediate.
+;;;
+;;; simon-filter-cycle-hook (production)
+;;; simon-filter-reward-hook (production reward time)
+;;;    Cycle and reward hooks replacing the ones set in simon-core.lisp.
+;;;    The reward hook always returns nil (the reward is not changed).
+;;;
+;;; simon-filter-flush ()
+;;;    Returns and clears the buffered events, in firing order:
+;;;      ("production" production time)
+;;;      ("reward" production reward time time)
+;;;
+;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;;
+
+;;; --------- TRIAL TRACE CAPTURE ---------
+(defvar *simon-trace-productions* nil)
+(defvar *simon-trace-chunks* nil)
+(defvar *simon-trace-end* nil)
+
+(defun simon-trace-configure (productions chunks end-production)
+  (setf *simon-trace-productions* (mapcar 'string->name productions))
+  (setf *simon-trace-chunks* (mapcar 'string->name chunks))
+  (setf *simon-trace-end* (string->name end-production))
+  t)
+
+(defun simon-trace-record ()
+  (no-output
+    (list (mapcar (lambda (p) (caar (spp-fct (list p :u)))) *simon-trace-productions*)
+          (mapcar (lambda (c) (caar (sdp-fct (list c :last-retrieval-activation)))) *simon-trace-chunks*)
+          (caar (spp-fct (list (first *simon-trace-productions*) :at))))))
+
+(defun simon-trace-cycle-hook (production)
+  (when (and *simon-trace-end* (eq production *simon-trace-end*))
+    (apply 'call-act-r-command "simon-trial-trace" (simon-trace-record)))
+  nil)
+
+;;; --------- EVENT FILTER ---------
+(defvar *simon-filter-productions* nil)
+(defvar *simon-filter-rewards* nil)
+(defvar *simon-filter-buffered* nil)
+(defvar *simon-filter-immediate* nil)
+(defvar *simon-filter-events* nil)
+
+(defun simon-filter-configure (productions rewards buffered immediate)
+  (setf *simon-filter-productions* (mapcar 'string->name productions))
+  (setf *simon-filter-rewards* (mapcar 'string->name rewards))
+  (setf *simon-filter-buffered* buffered)
+  (setf *simon-filter-immediate* (mapcar 'string->name immediate))
+  (setf *simon-filter-events* nil)
+  t)
+
+(defun simon-filter-cycle-hook (production)
+  (when (member production *simon-filter-productions*)
+    (if (and *simon-filter-buffered* (not (member production *simon-filter-immediate*)))
+        (push (list "production" production (mp-time)) *simon-filter-events*)
+      (call-act-r-command "detect-production-hook" production)))
+  nil)
+
+(defun simon-filter-reward-hook (production reward time)
+  (when (member production *simon-filter-rewards*)
+    (if *simon-filter-buffered*
+        (push (list "reward" production reward time (mp-time)) *simon-filter-events*)
+      (call-act-r-command "detect-reward-hook" production reward time)))
+  nil)
+
+(defun simon-filter-flush ()
+  (let ((events (reverse *simon-filter-events*)))
+    (setf *simon-filter-events* nil)
+    events))
+
+;;; --------- COMMANDS ---------
+(dolist (command '(("simon-trace-configure" simon-trace-configure
+                    "Set the productions, chunks and trial-ending production recorded by simon-trace-cycle-hook.")
+                   ("simon-trace-cycle-hook" simon-trace-cycle-hook
+                    "Cycle hook which pushes one trace record per trial to simon-trial-trace. Do not call directly.")
+                   ("simon-filter-configure" simon-filter-configure
+                    "Set the productions and rewards forwarded by simon-filter-cycle-hook and simon-filter-reward-hook.")
+                   ("simon-filter-cycle-hook" simon-filter-cycle-hook
+                    "Cycle hook which forwards selected productions to detect-production-hook. Do not call directly.")
+                   ("simon-filter-reward-hook" simon-filter-reward-hook
+                    "Reward hook which forwards selected rewards to detect-reward-hook. Do not call directly.")
+                   ("simon-filter-flush" simon-filter-flush
+                    "Return and clear the production and reward events buffered by the filter hooks.")))
+  (when (check-act-r-command (first command))
+    (remove-act-r-command (first command)))
+  (add-act-r-command (first command) (second command) (third command)))
@@ -17,6 +17,15 @@ import numpy as np
 import pandas as pd
 import json
 import time
+import multiprocessing
+import queue
+import re
+import hashlib
+import tempfile
+import weakref
+from result_store import ResultStore
+from result_cache import ResultCache, cache_key, file_digest
+from seeds import SeedStream
 from datetime import datetime
 from functools import reduce
 import scipy.optimize as opt
@@ -30,6 +39,39 @@ SIMON_MAPPINGS = {"CIRCLE": "LEFT", "SQUARE": "RIGHT"}
 RESPONSE_MAPPINGS = {"LEFT": "f", "RIGHT": "j"}
 CUE_CONDITIONS = ("CONGRUENT-VALID", "CONGRUENT-INVALID", "INCONGRUENT-VALID", "INCONGRUENT-INVALID")
 
+# productions and chunks whose parameters are recorded after every trial
+UTILITY_PRODUCTIONS = ("PROCESS-SHAPE", "PROCESS-LOCATION", "DONT-PROCESS-SHAPE", "DONT-PROCESS-LOCATION")
+CHECK_PRODUCTIONS = ("CHECK-PASS-M3", "DONT-CHECK")
+RULE_CHUNKS = ("CIRCLE-LEFT", "SQUARE-RIGHT")
+
+# productions that end a trial phase, used to chain the phases in pipeline mode
+CUE_PRODUCTION = "PROCESS-FIXATION"         # goal step -> ATTEND-CUE
+STIMULUS_PRODUCTION = "PROCESS-CUE"         # goal step -> ATTEND-STIMULUS
+TRIAL_END_PRODUCTION = "MONITOR-CHECK-DONE" # goal cleared
+PIPELINE_PRODUCTIONS = (CUE_PRODUCTION, STIMULUS_PRODUCTION, TRIAL_END_PRODUCTION)
+
+# productions whose firing/reward events are used by production_hook() and reward_hook()
+HOOK_PRODUCTIONS = UTILITY_PRODUCTIONS + ("RESPOND", "RETRIEVE-INTENDED-RESPONSE-M3",
+                                          "CHECK-PASS-M3", "CHECK-DETECT-PROBLEM-UNLIMITED")
+REWARD_PRODUCTIONS = UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS
+
+# ACT-R parameters recorded with every run (without ':'), and those which change while the model runs
+ACTR_PARAMETERS = ('seed', 'ans', 'le', 'lf', 'mas', 'bll', 'egs', 'alpha', 'imaginal-activation', 'dat')
+VOLATILE_PARAMETERS = ("seed",)
+
+# categorical codes used by SimonLog
+RESPONSES = tuple(RESPONSE_MAPPINGS.values())
+CUE_KINDS = ("VALID", "INVALID")
+
+# stimulus codes: index into STIMULUS_TABLE of (shape, location, cue)
+STIMULUS_TABLE = tuple((shape, location, cue) for shape in SHAPES for location in LOCATIONS for cue in LOCATIONS)
+STIMULUS_KEYS = {"stimulus": np.arange(len(STIMULUS_TABLE), dtype=np.int8),
+                 "shape": np.array([SHAPES.index(s) for s, l, c in STIMULUS_TABLE], dtype=np.int8),
+                 "location": np.array([LOCATIONS.index(l) for s, l, c in STIMULUS_TABLE], dtype=np.int8),
+                 "cue": np.array([LOCATIONS.index(c) for s, l, c in STIMULUS_TABLE], dtype=np.int8),
+                 "condition": np.array([SIMON_MAPPINGS[s] != l for s, l, c in STIMULUS_TABLE], dtype=np.int8),
+                 "cue_condition": np.array([SIMON_MAPPINGS[s] != c for s, l, c in STIMULUS_TABLE], dtype=np.int8)}
+
 SEED = 100
 
 
@@ -120,6 +162,120 @@ class SimonStimulus:
     def __repr__(self):
         return self.__str__()
 
+
+class SimonStimuli:
+    """
+    A sequence of stimuli stored as codes into STIMULUS_TABLE
+    SimonStimulus objects are only created when a trial is accessed
+    """
+    __slots__ = ("codes",)
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return SimonStimuli(self.codes[i])
+        return SimonStimulus(*STIMULUS_TABLE[self.codes[i]])
+
+    def __iter__(self):
+        for code in self.codes:
+            yield SimonStimulus(*STIMULUS_TABLE[code])
+
+    def __repr__(self):
+        return "<%d stimuli>" % len(self)
+
+
+def stimulus_codes(n_trials=20, valid_cue_percentage=0.5, shuffle=True, seed=SEED, max_run=None, run_key="condition"):
+    """
+    Generates a trial sequence according to the Boksem(2006)'s paradigm, as an int8 array of
+    codes into STIMULUS_TABLE
+    There are 4 * n_trials trials (as in SimonTask.generate_stimuli()), round(4 * n_trials * valid_cue_percentage)
+    of them with a valid cue. The trials of each cue validity are split evenly over congruency x shape,
+    the remainder going to randomly chosen cells
+    :param seed: int or numpy Generator
+    :param max_run: longest allowed run of trials with the same run_key (a key of STIMULUS_KEYS)
+    """
+    rng = np.random.default_rng(seed)
+    total = 4 * n_trials
+    n_valid = int(round(total * valid_cue_percentage))
+    cue_condition, condition = STIMULUS_KEYS["cue_condition"], STIMULUS_KEYS["condition"]
+
+    # unshuffled order: congruent-valid, incongruent-valid, congruent-invalid, incongruent-invalid
+    blocks = []
+    for cue, n in ((0, n_valid), (1, total - n_valid)):
+        cells = np.flatnonzero(cue_condition == cue)
+        cells = cells[np.lexsort((STIMULUS_KEYS["shape"][cells], condition[cells]))]
+        counts = np.full(len(cells), n // len(cells))
+        extra = rng.choice(len(cells), n % len(cells), replace=False) if shuffle else np.arange(n % len(cells))
+        counts[extra] += 1
+        for pair in cells.reshape(2, -1):
+            n_pair = counts[np.isin(cells, pair)]
+            block = np.repeat(pair[np.newaxis, :], n_pair.min(), axis=0).ravel()
+            blocks.append(np.concatenate([block, pair[n_pair > n_pair.min()]]))
+    codes = np.concatenate(blocks).astype(np.int8)
+
+    if shuffle:  # Randomized if needed
+        rng.shuffle(codes)
+        if max_run:
+            limit_runs(codes, STIMULUS_KEYS[run_key], max_run, rng)
+    return codes
+
+
+def limit_runs(codes, keys, max_run, rng, max_iterations=1000):
+    """
+    Break up runs of more than max_run trials with equal keys[codes] by swapping trials (in place)
+    """
+    for _ in range(max_iterations):
+        key = keys[codes]
+        start = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        position = np.arange(len(key)) - np.repeat(start, np.diff(np.r_[start, len(key)]))
+        violations = np.flatnonzero(position == max_run)
+        if not len(violations):
+            return codes
+        for i, j in zip(violations, rng.integers(0, len(codes), len(violations))):
+            if keys[codes[j]] != keys[codes[i]]:
+                codes[i], codes[j] = codes[j], codes[i]
+    raise ValueError("Could not limit runs to %d trials after %d iterations" % (max_run, max_iterations))
+
+
+class StimulusBank:
+    """
+    Precomputed trial sequences of equal length, shared by many sessions (and processes)
+    The sequences are rows of a 2-D int8 .npy file of stimulus codes, opened memory-mapped
+
+    Example:
+        bank = StimulusBank.create("../data/stimuli.npy", n_sessions=1000, n_trials=20)
+        task = run_experiment(stimuli=bank.session(i))
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.codes = np.load(path, mmap_mode="r")
+
+    @classmethod
+    def create(cls, path, n_sessions, n_trials=20, valid_cue_percentage=0.5, seed=SEED, max_run=None, run_key="condition"):
+        """Generate n_sessions sequences with stimulus_codes() and save them to path"""
+        rng = np.random.default_rng(seed)
+        tmp = path + ".tmp.npy"
+        bank = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.int8, shape=(n_sessions, 4 * n_trials))
+        for i in range(n_sessions):
+            bank[i] = stimulus_codes(n_trials, valid_cue_percentage, seed=rng, max_run=max_run, run_key=run_key)
+        bank.flush()
+        del bank
+        os.replace(tmp, path)
+        return cls(path)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def session(self, i):
+        return SimonStimuli(self.codes[i])
+
+
 class SimonTrial:
     """A class for recording a Stroop trial"""
 
@@ -227,6 +383,105 @@ class SimonTrial:
         else:
             return t
 
+
+class SimonLog:
+    """
+    A columnar log of finished trials
+    Every column is a preallocated numpy array filled in place by append(), so logging a
+    trial does not keep its SimonTrial. Categorical columns hold codes into SHAPES, LOCATIONS
+    (location, cue), CONDITIONS, CUE_KINDS, RESPONSES and CHECK_PRODUCTIONS (-1 if missing)
+    """
+
+    # column name, dtype, values per trial
+    COLUMNS = (("shape", np.int8, ()), ("location", np.int8, ()), ("cue", np.int8, ()),
+               ("condition", np.int8, ()), ("cue_condition", np.int8, ()), ("response", np.int8, ()),
+               ("onset", np.float64, ()), ("offset", np.float64, ()),
+               ("check_count", np.int64, ()), ("check_onset", np.float64, ()), ("check_offset", np.float64, ()),
+               ("cost", np.float64, ()),
+               ("utility", np.float64, (len(UTILITY_PRODUCTIONS),)),
+               ("check_utility", np.float64, (len(CHECK_PRODUCTIONS),)),
+               ("activation", np.float64, (len(RULE_CHUNKS),)),
+               ("reward_index", np.int64, ()), ("reward_time", np.float64, ()), ("reward_production", np.int8, ()),
+               ("delivered_reward", np.float64, ()), ("passed_time", np.float64, ()), ("received_reward", np.float64, ()))
+
+    __slots__ = ("size", "capacity") + tuple(name for name, _, _ in COLUMNS)
+
+    def __init__(self, capacity=20):
+        """
+        :param capacity: number of trials to preallocate, the log grows by doubling beyond it
+        """
+        self.size = 0
+        self.capacity = 0
+        self.allocate(max(capacity, 1))
+
+    def allocate(self, capacity):
+        for name, dtype, width in SimonLog.COLUMNS:
+            column = np.empty((capacity,) + width, dtype=dtype)
+            if self.capacity:
+                column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def __len__(self):
+        return self.size
+
+    def append(self, trial):
+        """Copy a finished SimonTrial into the next row"""
+        if self.size == self.capacity:
+            self.allocate(2 * self.capacity)
+        i = self.size
+        stimulus = trial.stimulus
+        self.shape[i] = SHAPES.index(stimulus.shape)
+        self.location[i] = LOCATIONS.index(stimulus.location)
+        self.cue[i] = LOCATIONS.index(stimulus.cue)
+        self.condition[i] = 0 if stimulus.congruent else 1
+        self.cue_condition[i] = 0 if stimulus.valid else 1
+        self.response[i] = RESPONSES.index(trial.response) if trial.response in RESPONSES else -1
+        self.onset[i] = trial.onset
+        self.offset[i] = trial.offset
+        self.check_count[i] = trial.check_count
+        self.check_onset[i] = trial.check_onset
+        self.check_offset[i] = trial.check_offset
+        self.cost[i] = trial.cost
+        self.utility[i] = [p[2] for p in trial.utility_trace]
+        self.check_utility[i] = [p[2] for p in trial.check_utility_trace]
+        self.activation[i] = [c[2] for c in trial.chunk_trace]
+
+        # first reward of CHECK_PRODUCTIONS: [index, rewarded_time, production, delivered_reward, passed_time, received_reward]
+        if trial.expected_reward_check:
+            index, rewarded_time, production, delivered_reward, passed_time, received_reward = trial.expected_reward_check
+            self.reward_index[i] = index
+            self.reward_production[i] = CHECK_PRODUCTIONS.index(production)
+        else:
+            rewarded_time, delivered_reward, passed_time, received_reward = np.nan, np.nan, np.nan, np.nan
+            self.reward_index[i] = -1
+            self.reward_production[i] = -1
+        self.reward_time[i] = rewarded_time
+        self.delivered_reward[i] = delivered_reward
+        self.passed_time[i] = passed_time
+        self.received_reward[i] = received_reward
+        self.size += 1
+
+    def __getitem__(self, name):
+        """A column of the logged trials (a view, not a copy)"""
+        return getattr(self, name)[:self.size]
+
+    @staticmethod
+    def labels(codes, values):
+        """Decode a categorical column into an object array of values"""
+        return np.asarray(values, dtype=object)[codes]
+
+    def accuracy(self):
+        correct = np.array([RESPONSES.index(RESPONSE_MAPPINGS[SIMON_MAPPINGS[shape]]) for shape in SHAPES])
+        return (self["response"] == correct[self["shape"]]).astype(np.float64)
+
+    def response_time(self):
+        return self["offset"] - self["onset"]
+
+    def check_time(self):
+        """duration from CHECK-DETECT-PROBLEM-UNLIMITED to RESPOND"""
+        return np.maximum(self["check_offset"] - self["check_onset"], 0.0)
+
 '''
 def generate_stimuli(shuffle=True, n_trials=2, valid_cue_percentage=0.5):
     "Generates stimuli according to the Boksem(2006)'s paradigm"
@@ -250,25 +505,35 @@ def generate_stimuli(shuffle=True, n_trials=2, valid_cue_percentage=0.5):
 class SimonTask:
     """A simple version of the Stroop task"""
 
-    def __init__(self, stimuli=None, setup=False, param_set=None):
+    def __init__(self, stimuli=None, setup=False, param_set=None, stimulus_seed=None):
         """Initializes a Stroop task (if there are stimuli)
            motivation_value is the chunk set to goal buffer that counts for how many times
            the model attempts to retrieve until reaching correct rule
+           stimuli is a list of SimonStimulus, a SimonStimuli or an array of stimulus codes
+           (e.g. StimulusBank.session()); if there are none, stimulus_seed sets the trial order of
+           new stimuli (default: SEED)
         """
-        if not stimuli:
-            self.stimuli = self.generate_stimuli(param_set)
-            if setup:
-                self.setup()
+        if stimuli is None or len(stimuli) == 0:
+            self.stimuli = self.generate_stimuli(param_set, seed=stimulus_seed)
+        elif isinstance(stimuli, (list, SimonStimuli)):
+            self.stimuli = stimuli
+        else:
+            self.stimuli = SimonStimuli(np.asarray(stimuli))
+        if setup:
+            self.setup()
                 
         # set motivation parameter and :at (production cost parameters / default:0.05)
         #self.set_motivation_parameters(param_set)
             
 
-    def setup(self, win=None):
-        """Sets up and prepares for first trial"""
+    def setup(self, win=None, pipeline=False):
+        """Sets up and prepares for first trial
+           pipeline=True runs the whole session inside one actr.run(), see run_pipeline()
+        """
         self.window = win
+        self.pipeline = pipeline
         self.index = 0
-        self.log = []   # log behaviral
+        self.log = SimonLog(len(self.stimuli))   # log behaviral
         self.phase = "fixation"
         self.trial_trace = True
         self.current_trial = SimonTrial(self.stimuli[self.index])
@@ -278,12 +543,24 @@ class SimonTask:
         self.reward_trace = []
 
     #################### SETUP MODEL  ####################
-    def setup_model(self, model="simon-motivation-model3",  param_set=None, reload=True, verbose=True):
-        """Sets up model"""
+    def setup_model(self, model="simon-motivation-model3",  param_set=None, reload=True, verbose=True, capture="poll", events="all", snapshot=False, warm=False):
+        """Sets up model
+           capture="poll" requests the trace values after every trial, capture="push" lets
+           simon-hooks.lisp send them when the trial ends (see install_trace_capture())
+           events="all" sends every production/reward event to the hooks, "filtered" only the
+           ones used by the hooks and "buffered" sends those once per trial (see install_event_filter())
+           snapshot=True restores the loaded model with a reset instead of loading the .lisp files
+           again (see restore_model())
+           warm=True also keeps the default parameters of the loaded model and only sends the
+           parameters which differ from the ones in use (see WarmModel)
+        """
+        self.capture = capture
+        self.events = events
         script_dir = os.path.join(os.path.dirname(os.path.realpath('../__file__')), 'script')
 
         # add commands
         self.add_actr_commands()
+        warm_state = current_warm_model(model) if warm else None
 
         # load model-core.lisp
         if reload:
@@ -294,17 +571,33 @@ class SimonTask:
             actr.schedule_event_now("detect-production-hook")
             actr.schedule_event_now("detect-reward-hook")
 
+            # load simon-hooks.lisp first, it does not change the model restored below
+            if events != "all" or capture == "push":
+                load_hooks(script_dir)
+
             # load model
-            actr.load_act_r_model(os.path.join(script_dir, "simon-core.lisp"))
-            actr.load_act_r_model(os.path.join(script_dir, "simon-base.lisp"))
-            actr.load_act_r_model(os.path.join(script_dir, model + ".lisp"))
+            if warm:
+                warm_state = warm_model(model)
+            elif snapshot:
+                restore_model(model)
+            else:
+                for path in model_files(model):
+                    actr.load_act_r_model(path)
+
+            if events != "all":
+                self.install_event_filter(script_dir, buffered=(events == "buffered"))
+            if capture == "push":
+                self.install_trace_capture(script_dir)
 
         # diable duplicate productions
         actr.pdisable('CHECK-PASS', 'RETRIEVE-INTENDED-RESPONSE')
 
         # load new parameter sets
-        self.parameters = self.get_default_parameters()
-        self.set_parameters(param_set)
+        if warm_state:
+            self.parameters = self.get_default_parameters(warm_state.applied)
+        else:
+            self.parameters = self.get_default_parameters()
+        self.set_parameters(param_set, warm=warm_state)
 
         # init cost
         self.curr_cost = self.cost_function(init_cost=self.parameters["init_cost"])
@@ -316,7 +609,7 @@ class SimonTask:
 
     #################### SETUP PARAMETER  ####################
     def get_parameters_name(self):
-        param_names = ['seed', 'ans', 'le', 'lf', 'mas', 'bll', 'egs', 'alpha', 'imaginal-activation', 'dat']
+        param_names = list(ACTR_PARAMETERS)
         return param_names
 
     def get_parameter(self, param_name):
@@ -330,21 +623,21 @@ class SimonTask:
         return actr.get_parameter_value(":" + param_name)
 
     def get_parameters(self, *kwargs):
-        param_set = {}
-        for param_name in kwargs:
-            param_set[param_name] = self.get_parameter(param_name)
-        return param_set
+        assert all(param_name in self.get_parameters_name() for param_name in kwargs)
+        values = actr.get_parameter_values(*[":" + param_name for param_name in kwargs])
+        return {param_name: values[":" + param_name] for param_name in kwargs}
 
-    def set_parameters(self, kwargs):
+    def set_parameters(self, kwargs, warm=None):
         """
         set parameter to current model
         :param kwargs: dict pair, indicating the parameter name and value (e.g. ans=0.1, r1=1, r2=-1)
+        :param warm: WarmModel of the current model, only parameters it does not already use are sent
         :return:
         """
         #print("start assign set_parameters", kwargs)
         #print('before', self.parameters)
-        actr.hide_output()
         update_parameters = self.parameters.copy()
+        values = {}
         # if new para given
         if kwargs:
             update_parameters.update(kwargs)
@@ -353,31 +646,42 @@ class SimonTask:
                     pass
                 # TODO: fixed
                 elif key == "init_cost":
-                    actr.set_parameter_value(":dat", value)
+                    values["dat"] = value
                     #actr.spp(["PROCESS-SHAPE", "PROCESS-LOCATION", "DONT-PROCESS-SHAPE", "DONT-PROCESS-LOCATION"], ":at", value)
                 else:
-                    actr.set_parameter_value(':' + key, value)
+                    values[key] = value
             self.parameters = update_parameters
 
         #if no new param given
         else:
             #actr.spp(":at", self.parameters["init_cost"])
-            actr.set_parameter_value(":dat", self.parameters["init_cost"])
+            values["dat"] = self.parameters["init_cost"]
+
+        with actr.suppress_output():
+            if warm:
+                warm.apply(values)
+                self.parameters.update((name, warm.applied[name]) for name in VOLATILE_PARAMETERS if name not in values)
+            else:
+                actr.set_parameter_values({':' + key: value for key, value in values.items()})
         self.parameters["seed"] = str(self.parameters["seed"])
-        actr.unhide_output()
         #print('after', self.parameters)
 
-    def get_default_parameters(self):
+    def get_default_parameters(self, actr_parameters=None):
         """
         default parameter sets
+        :param actr_parameters: values of get_parameters_name() if already known (see WarmModel),
+            otherwise they are read from the current model
         """
-        defaul_parameters = self.get_parameters(*self.get_parameters_name())
+        if actr_parameters:
+            defaul_parameters = {name: actr_parameters[name] for name in self.get_parameters_name()}
+        else:
+            defaul_parameters = self.get_parameters(*self.get_parameters_name())
         defaul_other_parameters = {"motivation": 1, "init_cost": 0.05, "update_cost":False, "valid_cue_percentage":0.8, "n_trials":20}
         defaul_parameters.update(defaul_other_parameters)
         return defaul_parameters
 
-    def generate_stimuli(self, param_set, shuffle=True, n_trials=20, valid_cue_percentage=0.5):
-        "Generates stimuli according to the Boksem(2006)'s paradigm"
+    def generate_stimuli(self, param_set, shuffle=True, n_trials=20, valid_cue_percentage=0.5, seed=None):
+        "Generates stimuli according to the Boksem(2006)'s paradigm, see stimulus_codes()"
 
         try:
             n_trials = param_set["n_trials"]
@@ -388,22 +692,8 @@ class SimonTask:
         except:
             valid_cue_percentage = valid_cue_percentage
 
-        congr_valid = [("CIRCLE", "LEFT", "LEFT"), ("SQUARE", "RIGHT", "RIGHT")]
-        incongr_valid = [("CIRCLE", "RIGHT", "LEFT"), ("SQUARE", "LEFT", "RIGHT")]
-        congr_invalid = [("CIRCLE", "LEFT", "RIGHT"), ("SQUARE", "RIGHT", "LEFT")]
-        incongr_invalid = [("CIRCLE", "RIGHT", "RIGHT"), ("SQUARE", "LEFT", "LEFT")]
-
-        valid = congr_valid * int(n_trials * (valid_cue_percentage)) + incongr_valid * int(
-            n_trials * (valid_cue_percentage))
-        invalid = congr_invalid * int(n_trials * (1 - valid_cue_percentage)) + incongr_invalid * int(
-            n_trials * (1 - valid_cue_percentage))
-        lst = valid + invalid
-
-        if shuffle:  # Randomized if needed
-            random.seed(SEED)
-            random.shuffle(lst)
-
-        return [SimonStimulus(shape=x[0], location=x[1], cue=x[2]) for x in lst]
+        return SimonStimuli(stimulus_codes(n_trials, valid_cue_percentage, shuffle=shuffle,
+                                           seed=SEED if seed is None else seed))
 
 
 
@@ -470,6 +760,7 @@ class SimonTask:
         actr.add_command("stroop-update-cue", self.cue, "Update window: cue")
         
         actr.add_command("stroop-update-stimulus", self.stimulus, "Update window: stimulus")
+        actr.add_command("stroop-update-done", self.done, "Update window: done")
         actr.add_command("stroop-accept-response", self.accept_response, "Accepts a response for the Stroop task")
         #actr.add_command("stroop-deliver-rewards", self.deliver_rewards, "Delivers a reward")
         actr.monitor_command("output-key", "stroop-accept-response")
@@ -478,6 +769,7 @@ class SimonTask:
 
         actr.add_command("detect-production-hook",self.production_hook, "Detect if a production fires")
         actr.add_command("detect-reward-hook", self.reward_hook, "Detect if a reward is delivered")
+        actr.add_command("simon-trial-trace", self.trial_trace_hook, "Receive the trace record of a trial")
 
         # Note: comment this line for appropriately reloading model,
         # only schedule this event if reloading, dont scheudle if not reload
@@ -499,106 +791,166 @@ class SimonTask:
         #actr.remove_command_monitor("trigger-reward","reward-check")
         #actr.remove_command("reward-check")
         actr.remove_command("stroop-update-stimulus")
+        actr.remove_command("stroop-update-done")
         #actr.remove_command("stroop-deliver-rewards")
 
         actr.remove_command("detect-production-hook")
         actr.remove_command("detect-reward-hook")
+        actr.remove_command("simon-trial-trace")
         
     def get_actr_goal_step(self):
-        actr.hide_output()
-        goal_chunk = actr.buffer_chunk('GOAL')[0]
-        step = actr.chunk_slot_value(goal_chunk, 'STEP')
-        actr.unhide_output()
+        with actr.suppress_output():
+            goal_chunk = actr.buffer_chunk('GOAL')[0]
+            step = actr.chunk_slot_value(goal_chunk, 'STEP')
         return step
 
     def update_window(self, time=200):
-        #print('GOAL STEP:', self.get_actr_goal_step())
-        if self.phase == "done":
-            self.done()
-            actr.run(time)
-        #elif self.phase == "fixation":
-        elif self.get_actr_goal_step() == None:
-            #  MOTIVATION PARAMETER
-            actr.schedule_event_now("stroop-set-motivation") 
-            actr.schedule_event_relative(0.01,"stroop-update-fixation") 
-            #self.set_motivation()
-            #self.fixation()
-            actr.run(time)
-            #actr.run_full_time(10)
-            #actr.run_until_time(0.15)
-           
-            self.phase = "cue"
-            self.update_window()
-        #elif self.phase == "cue":
-        elif self.get_actr_goal_step() == "ATTEND-CUE":
-            actr.schedule_event_relative(0.01,"stroop-update-cue") 
-            #self.cue()
-            actr.run(time)
-            self.phase = "stimulus"
-            self.update_window()
-        #elif self.phase == "stimulus":
-        elif self.get_actr_goal_step() == "ATTEND-STIMULUS":
-            self.current_trial.onset = actr.mp_time()
-            #print('self.current_trial.onset', self.current_trial.onset)
-            
-            # update window
-            actr.schedule_event_relative(0.01,"stroop-update-stimulus") 
-            #self.stimulus()
-
-            actr.run(time)
-            # DELIVER REWARD PARAMETER TO PRODUCTION
-            #self.deliver_rewards()
-            #actr.schedule_event_relative(0.01,"stroop-deliver-rewards")
-            
-            # self.current_trial.offset = actr.mp_time()
-
-            # NEW: record the production utility
-            self.current_trial.utility_trace=[self.extract_production_parameter('PROCESS-SHAPE', ':u'),
-                                                 self.extract_production_parameter('PROCESS-LOCATION', ':u'),
-                                                 self.extract_production_parameter('DONT-PROCESS-SHAPE', ':u'),
-                                                 self.extract_production_parameter('DONT-PROCESS-LOCATION', ':u')]
-
-            # record activation
-            self.current_trial.chunk_trace = [self.extract_chunk_parameter('CIRCLE-LEFT', ':Last-Retrieval-Activation'),
-                                              self.extract_chunk_parameter('SQUARE-RIGHT', ':Last-Retrieval-Activation')]
-
-            # record cost
-            '''
-            self.current_trial.cost_trace=[self.extract_production_parameter('PROCESS-SHAPE', ':at'),
-                                           self.extract_production_parameter('PROCESS-LOCATION', ':at'),
-                                           self.extract_production_parameter('DONT-PROCESS-SHAPE', ':at'),
-                                           self.extract_production_parameter('DONT-PROCESS-LOCATION', ':at')]
-            '''
-            actr.hide_output()
-            self.current_trial.cost = actr.spp(":at")[0][0]
-            actr.unhide_output()
-
-            # record check utility trace
-            self.current_trial.check_utility_trace = [self.extract_production_parameter('CHECK-PASS-M3', ':u'),
-                                                      self.extract_production_parameter('DONT-CHECK', ':u')]
-
-            # record cost
-
-            #print('self.current_trial.offset', self.current_trial.offset)
-
-            self.index += 1
-            SimonTask.increment_trial_id()  # increment one trial
-            self.log.append(self.current_trial)
-            if self.index >= len(self.stimuli):
-                self.phase = "done"
+        """
+        Run the whole session: a loop over the trial phases fixation -> cue -> stimulus,
+        driven by the goal step of the model. Each iteration runs one phase and the
+        loop ends after the "done" screen
+        """
+        if self.pipeline:
+            self.run_pipeline(time)
+            self.finish_run()
+            return
+
+        while True:
+            #print('GOAL STEP:', self.get_actr_goal_step())
+            if self.phase == "done":
+                self.done()
+                actr.run(time)
+                break
+
+            step = self.get_actr_goal_step()
+            #elif self.phase == "fixation":
+            if step == None:
+                #  MOTIVATION PARAMETER
+                self.schedule_fixation()
+                #self.set_motivation()
+                #self.fixation()
+                actr.run(time)
+                #actr.run_full_time(10)
+                #actr.run_until_time(0.15)
+
+                self.phase = "cue"
+            #elif self.phase == "cue":
+            elif step == "ATTEND-CUE":
+                actr.schedule_event_relative(0.01,"stroop-update-cue")
+                #self.cue()
+                actr.run(time)
+                self.phase = "stimulus"
+            #elif self.phase == "stimulus":
+            elif step == "ATTEND-STIMULUS":
+                self.current_trial.onset = actr.mp_time()
+                #print('self.current_trial.onset', self.current_trial.onset)
+
+                # update window
+                actr.schedule_event_relative(0.01,"stroop-update-stimulus")
+                #self.stimulus()
+
+                actr.run(time)
+                # DELIVER REWARD PARAMETER TO PRODUCTION
+                #self.deliver_rewards()
+                #actr.schedule_event_relative(0.01,"stroop-deliver-rewards")
+
+                # self.current_trial.offset = actr.mp_time()
+
+                self.finish_trial()
+
+                # proceed to next trial
             else:
-                self.current_trial = SimonTrial(self.stimuli[self.index])
-                self.phase = "fixation"
-
-            # update cost
-            self.update_cost()
-
-            # proceed to next trial
-            self.update_window()
+                break
+        self.finish_run()
 
         # remove actr commands
         #self.remove_actr_commands()
 
+    def finish_run(self):
+        """
+        Replay the events buffered after the last trial (events="buffered"), e.g. while the done screen runs
+        """
+        if self.events == "buffered":
+            self.flush_hook_events()
+
+    def finish_trial(self):
+        """
+        Record the trace of the current trial, log it and move on to the next trial
+        """
+        if self.events == "buffered":
+            self.flush_hook_events()
+
+        # NEW: record the production utility, activation, cost and check utility
+        # all trace values are requested in a single round-trip, unless ACT-R already pushed them
+        if self.capture != "push" or not self.current_trial.utility_trace:
+            self.extract_trial_trace()
+
+        # record cost
+        '''
+        self.current_trial.cost_trace=[self.extract_production_parameter('PROCESS-SHAPE', ':at'),
+                                       self.extract_production_parameter('PROCESS-LOCATION', ':at'),
+                                       self.extract_production_parameter('DONT-PROCESS-SHAPE', ':at'),
+                                       self.extract_production_parameter('DONT-PROCESS-LOCATION', ':at')]
+        '''
+
+        #print('self.current_trial.offset', self.current_trial.offset)
+
+        self.index += 1
+        SimonTask.increment_trial_id()  # increment one trial
+        self.log.append(self.current_trial)
+        if self.index >= len(self.stimuli):
+            self.phase = "done"
+        else:
+            self.current_trial = SimonTrial(self.stimuli[self.index])
+            self.phase = "fixation"
+
+        # update cost
+        self.update_cost()
+
+    def run_pipeline(self, time=200):
+        """
+        Run the whole session inside a single actr.run(). The phases are chained on the
+        ACT-R side: the first fixation is scheduled here, and every following screen is
+        scheduled by production_hook() when the production ending the previous phase fires
+            CUE_PRODUCTION -> cue, STIMULUS_PRODUCTION -> stimulus,
+            TRIAL_END_PRODUCTION -> next fixation (or done)
+        :param time: time limit per phase, as in update_window()
+        """
+        self.schedule_fixation()
+        actr.run(time * (3 * len(self.stimuli) + 1))
+        if self.phase != "done":
+            print("WARNING: pipeline stopped at trial %d in phase %s" % (self.index, self.phase))
+
+    def schedule_fixation(self):
+        #  MOTIVATION PARAMETER
+        actr.schedule_event_now("stroop-set-motivation")
+        actr.schedule_event_relative(0.01, "stroop-update-fixation")
+
+    def pipeline_hook(self, fired_production):
+        """
+        Schedule the next screen when a trial phase is over (pipeline mode)
+        """
+        if fired_production == CUE_PRODUCTION and self.phase == "fixation":
+            self.phase = "cue"
+            actr.schedule_event_relative(0.01, "stroop-update-cue")
+        elif fired_production == STIMULUS_PRODUCTION and self.phase == "cue":
+            self.phase = "stimulus"
+            self.current_trial.onset = actr.mp_time()
+            actr.schedule_event_relative(0.01, "stroop-update-stimulus")
+        elif fired_production == TRIAL_END_PRODUCTION and self.phase == "stimulus" and self.capture != "push":
+            self.end_pipeline_trial()
+
+    def end_pipeline_trial(self):
+        """
+        Finish the current trial and schedule the next fixation (or done) screen
+        With capture="push", this is triggered by the pushed trace record instead of TRIAL_END_PRODUCTION
+        """
+        self.finish_trial()
+        if self.phase == "done":
+            actr.schedule_event_relative(0.01, "stroop-update-done")
+        else:
+            self.schedule_fixation()
+
     def accept_response(self, model, response):
         """A valid response is a key pressed during the 'stimulus' phase"""
         if self.phase == "stimulus":
@@ -641,32 +993,37 @@ class SimonTask:
     def production_hook(self, *params):
         """
         Detect the time when one of 4 production fires
+        Buffered events (events="buffered") carry their firing time as a second parameter
         """
         fired_production=params[0]
+        mp_time = (lambda: params[1]) if len(params) > 1 else actr.mp_time
         if fired_production in ["PROCESS-SHAPE", "PROCESS-LOCATION", "DONT-PROCESS-SHAPE", "DONT-PROCESS-LOCATION"]:
-            self.production_trace.append((self.index, actr.mp_time(), fired_production))
+            self.production_trace.append((self.index, mp_time(), fired_production))
         if fired_production == "RESPOND":
             self.current_trial.responded = True
 
         if ((not self.current_trial.responded) and (self.current_trial.check_count == 0) and (fired_production=="RETRIEVE-INTENDED-RESPONSE-M3")):
                 #and fired_production=="CHECK-DETECT-PROBLEM-UNLIMITED"):
-            self.current_trial.check_onset = actr.mp_time()
+            self.current_trial.check_onset = mp_time()
             #print("TEST check_time1", "P: ", fired_production, "check_onset:", self.current_trial.check_onset)
 
         # number of check is discrete variable representing control intensity
         if (not self.current_trial.responded) and (fired_production in ["CHECK-PASS-M3", "CHECK-DETECT-PROBLEM-UNLIMITED"]):
             self.current_trial.check_count += 1
-            self.current_trial.check_offset = actr.mp_time()
+            self.current_trial.check_offset = mp_time()
             self.current_trial.detect_problem = True
             #print("TEST: check_count:", self.index, "P: ", fired_production, "check_count:", self.current_trial.check_count)
             #print("TEST check_time2", "P: ", fired_production, "check_offset:", self.current_trial.check_offset,
             #      "check time", self.current_trial.check_time)
 
         if (not self.current_trial.responded) and (self.current_trial.check_count > 0) and (self.current_trial.detect_problem) and (fired_production == "RETRIEVE-INTENDED-RESPONSE-M3"):
-            self.current_trial.check_offset = actr.mp_time()
+            self.current_trial.check_offset = mp_time()
             #print("TEST check_time2", "P: ", fired_production, "check_offset:", self.current_trial.check_offset,
             #      "check time", self.current_trial.check_time)
 
+        # chain the next screen once this production has been recorded for the current trial
+        if self.pipeline:
+            self.pipeline_hook(fired_production)
 
         # time of check is continuous variable representing control intensity
         #if ((not self.current_trial.responded) and (self.current_trial.check_count > 0) and fired_production in ["CHECK-PASS-M3", "DONT-CHECK"]):
@@ -678,20 +1035,45 @@ class SimonTask:
         """
         Detect the time when reward is delivered
         If return, then will replace original reward calcualtion
+        Buffered events (events="buffered") carry the reward time as a fourth parameter
         """
         production = params[0]
         delivered_reward = params[1]
         passed_time = params[2]
+        mp_time = (lambda: params[3]) if len(params) > 3 else actr.mp_time
         received_reward = delivered_reward-passed_time
 
         if production in ["PROCESS-SHAPE", "PROCESS-LOCATION", "DONT-PROCESS-SHAPE", "DONT-PROCESS-LOCATION"]:
-            self.reward_trace.append((self.index, actr.mp_time(), production, delivered_reward, passed_time, received_reward))
+            self.reward_trace.append((self.index, mp_time(), production, delivered_reward, passed_time, received_reward))
 
         if production in ["DONT-CHECK", "CHECK-PASS-M3"]:
             if len(self.current_trial.expected_reward_check)==0:
-                self.current_trial.expected_reward_check = [self.index, actr.mp_time(), production, delivered_reward, passed_time, received_reward]
+                self.current_trial.expected_reward_check = [self.index, mp_time(), production, delivered_reward, passed_time, received_reward]
             #print("++REWARD TEST", self.index, production, delivered_reward, passed_time, received_reward)
             #print("self.current.expected_reward_check", self.current_trial.expected_reward_check)
+    def flush_hook_events(self):
+        """
+        Replay the production and reward events buffered by simon-hooks.lisp (events="buffered")
+        """
+        for event in actr.call_command("simon-filter-flush") or []:
+            if event[0] == "production":
+                self.production_hook(*event[1:])
+            else:
+                self.reward_hook(*event[1:])
+
+    def install_event_filter(self, script_dir, buffered=False):
+        """
+        Replace the cycle and reward hooks of simon-core.lisp by the filters in simon-hooks.lisp:
+        only HOOK_PRODUCTIONS/REWARD_PRODUCTIONS reach production_hook()/reward_hook(), and with
+        buffered=True they are sent once per trial (PIPELINE_PRODUCTIONS are always sent at once)
+        """
+        load_hooks(script_dir)
+        actr.call_command("simon-filter-configure",
+                          list(HOOK_PRODUCTIONS + PIPELINE_PRODUCTIONS), list(REWARD_PRODUCTIONS),
+                          buffered, list(PIPELINE_PRODUCTIONS))
+        actr.set_parameter_value(":cycle-hook", None)
+        actr.set_parameter_values({":cycle-hook": "simon-filter-cycle-hook", ":reward-hook": "simon-filter-reward-hook"})
+
     '''
     def cost_function_old(self, old_at, c=0.001):
         """
@@ -743,9 +1125,8 @@ class SimonTask:
             old_cost = self.curr_cost
             new_cost = self.cost_function(init_cost=self.parameters["init_cost"])
             if new_cost > old_cost:
-                actr.hide_output()
-                actr.spp(":at", new_cost)
-                actr.hide_output()
+                with actr.suppress_output():
+                    actr.spp(":at", new_cost)
                 self.curr_cost = new_cost
 
     @classmethod
@@ -802,19 +1183,16 @@ class SimonTask:
         R = dict(zip(CUE_CONDITIONS, [(0, np.nan, np.nan)] * len(CUE_CONDITIONS)))
 
         if len(self.log) > 0:
+            accuracy = self.log.accuracy()
+            response_time = self.log.response_time()
 
-            cong_valid = [x for x in self.log if (x.stimulus.congruent & x.stimulus.valid)]
-            incn_valid = [x for x in self.log if (x.stimulus.incongruent & x.stimulus.valid)]
-            cong_invalid = [x for x in self.log if (x.stimulus.congruent & x.stimulus.invalid)]
-            incn_invalid = [x for x in self.log if (x.stimulus.incongruent & x.stimulus.invalid)]
-
-            # for cond, data in zip(CONDITIONS, [cong, incn]):
-            for cond, data in zip(CUE_CONDITIONS, [cong_valid, cong_invalid, incn_valid, incn_invalid]):
-                if len(data) > 0:
-                    acc = sum([x.accuracy for x in data]) / len(data)
-                    rt = sum([x.response_time for x in data]) / len(data)
-
-                    R[cond] = (len(data), acc, rt)
+            # CUE_CONDITIONS are ordered as (condition, cue_condition) codes
+            cue_conditions = 2 * self.log["condition"] + self.log["cue_condition"]
+            for code, cond in enumerate(CUE_CONDITIONS):
+                data = cue_conditions == code
+                n = int(data.sum())
+                if n > 0:
+                    R[cond] = (n, accuracy[data].sum() / n, response_time[data].sum() / n)
 
         return R
 
@@ -826,40 +1204,53 @@ class SimonTask:
                   (cond, n, acc, rt * 1000))
 
     def df_stats_model_outputs(self):
-        df = pd.DataFrame()
-        df['index'] = [i + 1 for i in range(len(self.log))]
-        df['onset_time'] = [t.onset for t in self.log]
-        df['accuracy'] = [t.accuracy for t in self.log]
-        df['pre_trial_accuracy'] = df['accuracy'].shift(1)
-        df['pre_trial_accuracy'] = df['pre_trial_accuracy'].apply(lambda x: "post-correct" 
-                                                                  if x==1 else ("post-error" if x==0 else "NaN"))
-        df['response_time'] = [t.response_time for t in self.log]
-        df['condition_stimulus'] = [t.stimulus.kind for t in self.log]
-        df['condition_cue'] = [t.stimulus.cue_kind for t in self.log]
-        df['stimulus_shape'] = [t.stimulus.shape for t in self.log]
-        df['stimulus_location'] = [t.stimulus.location for t in self.log]
-
-        df['check_count'] = [t.check_count for t in self.log]
-        df['check_time'] = [t.check_time for t in self.log]
-
-        # parameter
-        df['motivation'] = self.parameters["motivation"]
-        df['cost'] = [t.cost for t in self.log]
-
-        # record expected_reward_check for CHECK and NO-CHECK
-        df = pd.merge(df, pd.DataFrame([t.expected_reward_check for t in self.log],
-                               columns=['index', 'rewarded_time', 'production', 'delivered_reward', 'passed_time', 'received_reward']))
-
-        # record utility for CHECK-PASS and DONT-CHECK
-        df_check_utility = pd.DataFrame([[p[2] for p in t.check_utility_trace] for t in self.log],
-                                        columns=['CHECK-PASS-M3', 'DONT-CHECK'],
-                                        index=range(len(self.log))).reset_index().melt(id_vars='index',
-                                                                                       var_name='production',
-                                                                                       value_name=':u').sort_values(["index", "production"])
-        df_check_utility = df_check_utility.pivot(index="index", columns="production", values=":u")
-        df_check_utility.columns = ['u_check', 'u_dont_check']
-        df = pd.merge(df, df_check_utility, on="index")
-        
+        """
+        One row per trial, assembled directly from the SimonLog columns
+        Trial i (index i+1) is joined with the CHECK_PRODUCTIONS reward logged with index i+1
+        and the check utilities of trial i+1; trials without a match are dropped
+        """
+        log = self.log
+        n = len(log)
+        keys = np.arange(1, n + 1)
+
+        # keyed inner join of the trials with the reward records, sorted by their index
+        rewarded = np.flatnonzero(log["reward_index"] >= 0)
+        rewarded = rewarded[np.argsort(log["reward_index"][rewarded], kind="stable")]
+        first = np.searchsorted(log["reward_index"][rewarded], keys, side="left")
+        last = np.searchsorted(log["reward_index"][rewarded], keys, side="right")
+        matches = np.where(keys < n, last - first, 0)
+        rows = np.repeat(np.arange(n), matches)
+        reward = rewarded[np.repeat(first, matches) + np.arange(len(rows)) - np.repeat(np.cumsum(matches) - matches, matches)]
+        check = keys[rows]
+
+        accuracy = log.accuracy()
+        pre_trial_accuracy = np.empty(n, dtype=object)
+        pre_trial_accuracy[:1] = "NaN"
+        pre_trial_accuracy[1:] = np.array(["post-error", "post-correct"], dtype=object)[(accuracy[:-1] == 1).astype(np.intp)]
+
+        df = pd.DataFrame({'index': keys[rows],
+                           'onset_time': log["onset"][rows],
+                           'accuracy': accuracy[rows],
+                           'pre_trial_accuracy': pre_trial_accuracy[rows],
+                           'response_time': log.response_time()[rows],
+                           'condition_stimulus': log.labels(log["condition"][rows], [c.lower() for c in CONDITIONS]),
+                           'condition_cue': log.labels(log["cue_condition"][rows], [c.lower() for c in CUE_KINDS]),
+                           'stimulus_shape': log.labels(log["shape"][rows], SHAPES),
+                           'stimulus_location': log.labels(log["location"][rows], LOCATIONS),
+                           'check_count': log["check_count"][rows],
+                           'check_time': log.check_time()[rows],
+                           'motivation': self.parameters["motivation"],
+                           'cost': log["cost"][rows],
+                           # record expected_reward_check for CHECK and NO-CHECK
+                           'rewarded_time': log["reward_time"][reward],
+                           'production': log.labels(log["reward_production"][reward], CHECK_PRODUCTIONS),
+                           'delivered_reward': log["delivered_reward"][reward],
+                           'passed_time': log["passed_time"][reward],
+                           'received_reward': log["received_reward"][reward],
+                           # record utility for CHECK-PASS and DONT-CHECK
+                           'u_check': log["check_utility"][check, CHECK_PRODUCTIONS.index('CHECK-PASS-M3')],
+                           'u_dont_check': log["check_utility"][check, CHECK_PRODUCTIONS.index('DONT-CHECK')]},
+                          index=pd.RangeIndex(len(rows)))
         return df
     
     #################### ACTR TRACE DATA ####################
@@ -868,25 +1259,76 @@ class SimonTask:
         """
         This function will extract the parameter value of a production during model running
         """
-        assert (production_name in actr.all_productions() and
+        assert (actr.model_metadata().production_p(production_name) and
                 parameter_name in [':u', ':utility', ':at', ':reward', ':fixed-utility'])
-        actr.hide_output()
-        value = actr.spp(production_name, parameter_name)[0][0]
-        actr.unhide_output()
-        return (production_name, parameter_name, value)
+        with actr.suppress_output():
+            row = actr.spp_table([production_name], parameter_name)[0]
+        return row
 
     def extract_chunk_parameter(self, chunk_name, parameter_name):
         """
         This function will extract the parameter value of a chunk during model running
         """
-        try:
-            actr.hide_output()
-            value = actr.sdp(chunk_name, parameter_name)[0][0]
-            actr.unhide_output()
-            return (chunk_name, parameter_name, value)
-        except:
+        with actr.suppress_output():
+            row = actr.sdp_table([chunk_name], parameter_name)[0]
+        if row[2] is None:
             print('ERROR: WRONG', chunk_name, parameter_name)
+            return None
+        return row
     
+    def extract_trial_trace(self):
+        """
+        This function will extract all trace values of the current trial in one batch:
+            utility_trace - ':u' of UTILITY_PRODUCTIONS
+            chunk_trace - ':Last-Retrieval-Activation' of RULE_CHUNKS
+            cost - ':at' of the first utility production (all productions share :at)
+            check_utility_trace - ':u' of CHECK_PRODUCTIONS
+        """
+        with actr.suppress_output():
+            production_table, chunk_table, cost_table = actr.parameter_tables(
+                ("spp", UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS, [':u']),
+                ("sdp", RULE_CHUNKS, [':Last-Retrieval-Activation']),
+                ("spp", UTILITY_PRODUCTIONS[:1], [':at']))
+        assert actr.model_metadata().production_p(*UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS)
+
+        for c, param, value in chunk_table:
+            if value is None:
+                print('ERROR: WRONG', c, param)
+
+        self.record_trial_trace([value for _, _, value in production_table],
+                                [value for _, _, value in chunk_table],
+                                cost_table[0][2])
+
+    def record_trial_trace(self, production_values, chunk_values, cost):
+        """
+        Store the trace values of the current trial, in the order of
+            production_values - UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS (':u')
+            chunk_values - RULE_CHUNKS (':Last-Retrieval-Activation')
+        """
+        production_trace = [(p, ':u', value) for p, value in zip(UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS, production_values)]
+        self.current_trial.utility_trace = production_trace[:len(UTILITY_PRODUCTIONS)]
+        self.current_trial.check_utility_trace = production_trace[len(UTILITY_PRODUCTIONS):]
+        self.current_trial.chunk_trace = [(c, ':Last-Retrieval-Activation', value) for c, value in zip(RULE_CHUNKS, chunk_values)]
+        self.current_trial.cost = cost
+
+    def trial_trace_hook(self, production_values, chunk_values, cost):
+        """
+        Receive the trace record pushed by simon-hooks.lisp when TRIAL_END_PRODUCTION fires
+        (capture="push"). In pipeline mode this record also ends the trial
+        """
+        self.record_trial_trace(production_values, chunk_values, cost)
+        if self.pipeline and self.phase == "stimulus":
+            self.end_pipeline_trial()
+
+    def install_trace_capture(self, script_dir):
+        """
+        Load simon-hooks.lisp and let ACT-R push one trace record per trial to "simon-trial-trace"
+        """
+        load_hooks(script_dir)
+        actr.call_command("simon-trace-configure",
+                          list(UTILITY_PRODUCTIONS + CHECK_PRODUCTIONS), list(RULE_CHUNKS), TRIAL_END_PRODUCTION)
+        actr.set_parameter_value(":cycle-hook", "simon-trace-cycle-hook")
+
     def df_production_trace_outputs(self):
         """
         Process production trace data using hook function
@@ -906,41 +1348,67 @@ class SimonTask:
     def df_stats_trace_outputs(self, merge=True):
         """
         This function process trace data recorded in self.log
-        Return: (df_chunk, df_at, df_production, df_utility)
-        """
-        #df_performance = self.df_stats_model_outputs()
-
-        df_utility = pd.DataFrame([[p[2] for p in t.utility_trace] for t in self.log], 
-                                  columns=['PROCESS-SHAPE', 'PROCESS-LOCATION', 'DONT-PROCESS-SHAPE', 'DONT-PROCESS-LOCATION'],
-                                  index=range(len(self.log))).reset_index().melt(id_vars='index', 
-                                                                                  var_name='production', 
-                                                                                  value_name='u').sort_values(["index", "production"])
-        ''' 
-        df_at = pd.DataFrame([[p[2] for p in t.cost_trace] for t in self.log],
-                           columns=['PROCESS-SHAPE', 'PROCESS-LOCATION', 'DONT-PROCESS-SHAPE', 'DONT-PROCESS-LOCATION'],
-                           index=range(len(self.log))).reset_index().melt(id_vars='index', 
-                                                                          var_name='production', 
-                                                                          value_name=':at').sort_values(["index", "production"])
-        '''
-
-        df_chunk = pd.DataFrame([[c[2] for c in t.chunk_trace] for t in self.log],
-                           columns=['CIRCLE-LEFT', 'SQUARE-RIGHT'],
-                           index=range(len(self.log))).reset_index().melt(id_vars='index', 
-                                                                          var_name='rule', 
-                                                                          value_name='activation').sort_values(["index"])
-        df_production = pd.merge_ordered(self.df_production_trace_outputs(), self.df_reward_trace_outputs(), how='outer', on=['index', 'production'])
-
-        if merge:
-            data_frames = (df_production, df_utility)
-            df_merged1 = reduce(lambda left,right: pd.merge(left,right,on=['index', 'production'], how='outer'), data_frames)
-            df = df_merged1.merge(df_chunk, how="left", on="index")
-            #df = df_merged2.merge(df_check_utility, how="left", on="index")
-
-            # add motivation parameter
-            df['motivation'] = self.parameters['motivation']
-            return df
-        else:
+        The production/reward events are outer joined with the utility of every (index, production)
+        and left joined with the activation of every rule, by position in the SimonLog columns
+        Return: df or (df_production, df_utility, df_chunk)
+        """
+        log = self.log
+        n = len(log)
+        productions = np.array(sorted(UTILITY_PRODUCTIONS), dtype=object)
+        rules = np.array(RULE_CHUNKS, dtype=object)
+        utility = log["utility"][:, [UTILITY_PRODUCTIONS.index(p) for p in productions]]
+        activation = log["activation"]
+
+        df_production = pd.merge(self.df_production_trace_outputs(), self.df_reward_trace_outputs(),
+                                 how='outer', on=['index', 'production'], sort=True)
+        if not merge:
+            df_utility = pd.DataFrame({'index': np.repeat(np.arange(n), len(productions)),
+                                       'production': np.tile(productions, n),
+                                       'u': utility.ravel()})
+            df_chunk = pd.DataFrame({'index': np.repeat(np.arange(n), len(rules)),
+                                     'rule': np.tile(rules, n),
+                                     'activation': activation.ravel()})
             return (df_production, df_utility, df_chunk)
+
+        # utility of the recorded events, then one row for every (index, production) without events
+        index = df_production['index'].to_numpy(dtype=np.int64)
+        production = df_production['production'].to_numpy(dtype=object)
+        code = pd.Index(productions).get_indexer(production)
+        found = (code >= 0) & (index >= 0) & (index < n)
+        u = np.full(len(index), np.nan)
+        u[found] = utility[index[found], code[found]]
+        missing = np.ones((n, len(productions)), dtype=bool)
+        missing[index[found], code[found]] = False
+        missing_index, missing_code = np.nonzero(missing)
+
+        columns = {'index': np.concatenate([index, missing_index]),
+                   'production': np.concatenate([production, productions[missing_code]])}
+        for name in ['firing_time', 'rewarded_time', 'delivered_reward', 'passed_time', 'received_reward']:
+            columns[name] = np.concatenate([df_production[name].to_numpy(dtype=np.float64),
+                                            np.full(len(missing_index), np.nan)])
+        columns['u'] = np.concatenate([u, utility[missing_index, missing_code]])
+
+        # outer join order: sorted by (index, production)
+        _, production_rank = np.unique(columns['production'], return_inverse=True)
+        order = np.lexsort((production_rank, columns['index']))
+
+        # every row is repeated once per rule of its trial
+        index = columns['index'][order]
+        trial = (index >= 0) & (index < n)
+        repeat = np.where(trial, len(rules), 1)
+        rows = np.repeat(order, repeat)
+        rule = np.arange(len(rows)) - np.repeat(np.cumsum(repeat) - repeat, repeat)
+        trial = np.repeat(trial, repeat)
+
+        df = pd.DataFrame({name: column[rows] for name, column in columns.items()},
+                          columns=['index', 'firing_time', 'production', 'rewarded_time', 'delivered_reward',
+                                   'passed_time', 'received_reward', 'u'])
+        df['rule'] = np.where(trial, rules[np.where(trial, rule, 0)], np.nan)
+        df['activation'] = np.where(trial, activation[np.where(trial, columns['index'][rows], 0), np.where(trial, rule, 0)], np.nan)
+
+        # add motivation parameter
+        df['motivation'] = self.parameters['motivation']
+        return df
     
             
 
@@ -954,19 +1422,41 @@ def run_experiment(model="simon-motivation-model3",
                    visible=False,
                    trace=False,
                    param_set=None,
-                   reload=True):
-    """Runs an experiment"""
+                   reload=True,
+                   pipeline=False,
+                   capture="poll",
+                   events="all",
+                   seeds=None,
+                   stimuli=None,
+                   snapshot=False,
+                   warm=False):
+    """Runs an experiment
+       pipeline=True runs the whole session inside one actr.run() (see SimonTask.run_pipeline())
+       capture="push" lets ACT-R push the trial traces (see SimonTask.install_trace_capture())
+       events="filtered"/"buffered" filters hook events inside ACT-R (see SimonTask.install_event_filter())
+       seeds=(stimulus_seed, actr_seed) sets the trial order and ACT-R's :seed (see SeedStream),
+       a "seed" given in param_set is kept
+       stimuli replaces the generated trials, e.g. StimulusBank.session()
+       snapshot=True restores the model with a reset instead of loading it again (see restore_model())
+       warm=True keeps the model loaded and only sends changed parameters (see WarmModel)
+    """
+    stimulus_seed = None
+    if seeds:
+        stimulus_seed, actr_seed = seeds
+        param_set = dict(param_set or {})
+        param_set.setdefault("seed", [actr_seed, 0])
 
-    task = SimonTask(setup=False, param_set=param_set)
+    task = SimonTask(stimuli=stimuli, setup=False, param_set=param_set, stimulus_seed=stimulus_seed)
 
     # Everytime ACT-R is reloaded, all parameters are set to init
     # Load model and add ACT-R commands
-    task.setup_model(model=model, param_set=param_set, reload=reload, verbose=verbose)
+    task.setup_model(model=model, param_set=param_set, reload=reload, verbose=verbose, capture=capture, events=events,
+                     snapshot=snapshot, warm=warm)
 
     #print("TEST: in run_experiment()", task.parameters)
     win = actr.open_exp_window("* SIMON TASK *", width=800, height=600, visible=visible)
     actr.install_device(win)
-    task.setup(win)
+    task.setup(win, pipeline=pipeline)
     if not trace:
         actr.set_parameter_value(":v", False)
         task.trial_trace = False
@@ -983,57 +1473,356 @@ def run_experiment(model="simon-motivation-model3",
     # Returns the task as a Python object for further analysis of data
     return task
 
+def run_epoch(model="simon-motivation-model3", param_set=None, epoch=0, n_session=1, verbose=False, pipeline=False, capture="poll", events="all", base_seed=SEED, snapshot=False, warm=False):
+    """
+    Run all sessions of one simulation epoch
+    Every session gets its own trial order and ACT-R :seed, derived from (base_seed, param_set, epoch, session)
+    base_seed=None keeps the fixed trial order (SEED) and the model's :seed
+    Return: (df_epoch, df_epoch_param)
+    """
+    if verbose: print("Epoch #%03d" % epoch)
+    stream = SeedStream(base_seed, param_set) if base_seed is not None else None
+
+    # number of sessions per experiment
+    list_session_i = []
+    list_session_i_param = []
+    for i in range(n_session):
+        if verbose: print("\tSession #%03d" % i)
+        session_i = run_experiment(model,
+                                 reload=(not i),
+                                 visible=False,
+                                 verbose=verbose,
+                                 trace=False,
+                                 param_set=param_set,
+                                 pipeline=pipeline,
+                                 capture=capture,
+                                 events=events,
+                                 seeds=stream.session_seeds(epoch, i) if stream else None,
+                                 snapshot=snapshot,
+                                 warm=warm)
+        df_session_i = session_i.df_stats_model_outputs()
+
+        # log parameter file
+        session_i_param = pd.Series(session_i.parameters)
+        session_i_param['session'] = i+1
+
+        # log session index
+        df_session_i.insert(0, "session", i+1)
+
+        list_session_i.append(df_session_i)
+        list_session_i_param.append(session_i_param)
+
+    df_epoch = pd.concat(list_session_i, axis=0)
+    df_epoch_param = pd.DataFrame(list_session_i_param)
+
+    # log simulation index
+    df_epoch.insert(0, "epoch", epoch+1)
+    return df_epoch, df_epoch_param
+
+# seconds a worker waits for a free ACT-R port; a port is only missing when a worker died while holding it
+PORT_TIMEOUT = 60
+
+# worker process state set by init_worker(): queue of free ports, connection options and open connections
+WORKER = {"ports": None, "host": "127.0.0.1", "headless": True, "connections": {}}
+
+def init_worker(ports, host="127.0.0.1", headless=True):
+    """
+    Give a worker process the queue of free ACT-R ports. A port is taken for each epoch (see run_epoch_worker()),
+    so a worker the pool restarts simply takes the next free port
+    headless=True connects without the trace monitors, so ACT-R never sends its trace output to the worker
+    """
+    WORKER.update(ports=ports, host=host, headless=headless, connections={})
+
+def worker_connection(port):
+    """
+    The worker's connection to the ACT-R server on port, opened on first use
+    """
+    handle = WORKER["connections"].get(port)
+    if handle is None:
+        handle = actr.actr(WORKER["host"], port, headless=WORKER["headless"])
+        if not handle.interface.connected:
+            raise RuntimeError("Could not connect to ACT-R at %s:%s" % (WORKER["host"], port))
+        handle.interface.send("set-name", "ACT-R Tutorial Python interface")
+        WORKER["connections"][port] = handle
+    return handle
+
+def run_epoch_worker(args):
+    """
+    Run one epoch on a free ACT-R server and give its port back afterwards
+    """
+    function, kwargs = args
+    try:
+        port = WORKER["ports"].get(timeout=PORT_TIMEOUT)
+    except queue.Empty:
+        raise RuntimeError("No free ACT-R port after %d s, a worker holding one may have died" % PORT_TIMEOUT)
+    try:
+        with actr.use(worker_connection(port)):
+            return function(**kwargs)
+    finally:
+        WORKER["ports"].put(port)
+
+def map_epochs(function, epochs, ports, host="127.0.0.1", headless=True):
+    """
+    Shard epochs across worker processes, each epoch runs on an ACT-R server (port) no other epoch is using
+    :param function: epoch function, e.g. run_epoch()
+    :param epochs: list of keyword arguments, one dict per epoch
+    :param ports: list of ACT-R server ports
+    :param headless: workers do not receive the ACT-R trace output, see init_worker()
+    Yield results in epoch order
+    """
+    context = multiprocessing.get_context()
+    port_queue = context.Queue()
+    for port in ports:
+        port_queue.put(port)
+
+    with context.Pool(processes=len(ports), initializer=init_worker, initargs=(port_queue, host, headless)) as pool:
+        for result in pool.imap(run_epoch_worker, [(function, kwargs) for kwargs in epochs]):
+            yield result
+
+def model_files(model="simon-motivation-model3"):
+    """
+    The .lisp files loaded by SimonTask.setup_model(), in load order
+    """
+    script_dir = os.path.join(os.path.dirname(os.path.realpath('../__file__')), 'script')
+    return [os.path.join(script_dir, name + ".lisp") for name in ("simon-core", "simon-base", model)]
+
+def lisp_form_end(text, start):
+    """
+    Index of the parenthesis closing the form which starts at text[start]
+    """
+    depth = 0
+    i = start
+    while i < len(text):
+        c = text[i]
+        if c == ';':
+            i = text.find('\n', i)
+            if i < 0:
+                break
+        elif text.startswith('#|', i):
+            i = text.index('|#', i) + 1
+        elif text.startswith('#\\', i):
+            i += 2
+        elif c == '"':
+            i += 1
+            while text[i] != '"':
+                i += 2 if text[i] == '\\' else 1
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError("Unbalanced form at %d" % start)
+
+def compose_model(model="simon-motivation-model3"):
+    """
+    Write the model files as one .lisp file in which simon-base.lisp and the model are part of
+    the define-model of simon-core.lisp, so that an ACT-R reset rebuilds the whole model
+    (chunk types, DM, productions, parameters). Return the path, named after a hash of the sources
+    """
+    sources = [open(path).read() for path in model_files(model)]
+    digest = hashlib.sha256("\0".join(sources).encode()).hexdigest()[:16]
+    path = os.path.join(tempfile.gettempdir(), "simon-snapshots", "%s-%s.lisp" % (model, digest))
+    if not os.path.exists(path):
+        core = sources[0]
+        end = lisp_form_end(core, re.search(r'^\(define-model\b', core, re.M).start())
+        text = "\n".join([core[:end]] + sources[1:] + [core[end:]])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".%d.tmp" % os.getpid()
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return path
+
+# (composed model file, model generation) last loaded or reset by restore_model() on each ACT-R connection
+LOADED_SNAPSHOTS = weakref.WeakKeyDictionary()
+
+def restore_model(model="simon-motivation-model3"):
+    """
+    Bring model to its state right after loading: the first call on a connection loads
+    compose_model(), later calls only reset ACT-R. The model is loaded again when a .lisp file
+    changed, or when anything else reset or loaded a model on the connection since (see actr.model_changed())
+    Return: True if the model was loaded
+    """
+    path = compose_model(model)
+    handle = actr.connection()
+    loaded = LOADED_SNAPSHOTS.get(handle) != (path, handle.model_generation)
+    if loaded:
+        actr.load_act_r_model(path)
+    else:
+        actr.reset()
+    LOADED_SNAPSHOTS[handle] = (path, handle.model_generation)
+    return loaded
+
+# digest of the simon-hooks.lisp loaded on each ACT-R connection
+LOADED_HOOKS = weakref.WeakKeyDictionary()
+
+def load_hooks(script_dir):
+    """
+    Load simon-hooks.lisp, unless the connection already has this version. The hooks are Lisp
+    functions and ACT-R commands, which stay defined when models are loaded or reset
+    """
+    path = os.path.join(script_dir, "simon-hooks.lisp")
+    digest = file_digest(path)
+    handle = actr.connection()
+    if LOADED_HOOKS.get(handle) != digest:
+        actr.load_act_r_code(path)
+        LOADED_HOOKS[handle] = digest
+
+class WarmModel:
+    """
+    A model kept loaded on one ACT-R connection across runs (see warm_model())
+    defaults - ACTR_PARAMETERS after loading (names without ':')
+    applied - ACT-R parameters currently in use
+    generation - model generation of the connection when the model was restored, applied is only
+        valid while nothing else resets or loads a model (see actr.model_changed())
+    """
+
+    def __init__(self, model, defaults, generation):
+        self.model = model
+        self.defaults = defaults
+        self.applied = dict(defaults)
+        self.generation = generation
+
+    def apply(self, values):
+        """
+        Set the parameters of values which are not in use yet in one batch, and read the
+        VOLATILE_PARAMETERS values does not set
+        Return: the parameters which were sent
+        """
+        changed = {name: value for name, value in values.items()
+                   if name in VOLATILE_PARAMETERS or name not in self.applied or self.applied[name] != value}
+        unknown = [name for name in VOLATILE_PARAMETERS if name not in values]
+        if changed:
+            actr.set_parameter_values({":" + name: value for name, value in changed.items()})
+            self.applied.update(changed)
+        if unknown:
+            current = actr.get_parameter_values(*[":" + name for name in unknown])
+            self.applied.update((name, current[":" + name]) for name in unknown)
+        return changed
+
+# warm model of each ACT-R connection
+WARM_MODELS = weakref.WeakKeyDictionary()
+
+def warm_model(model="simon-motivation-model3"):
+    """
+    Restore model on the current ACT-R connection (see restore_model()) and return its WarmModel
+    The defaults are only read when the model is loaded, in one batch
+    """
+    handle = actr.connection()
+    warm = WARM_MODELS.get(handle)
+    if restore_model(model) or warm is None or warm.model != model:
+        values = actr.get_parameter_values(*[":" + name for name in ACTR_PARAMETERS])
+        warm = WARM_MODELS[handle] = WarmModel(model, {name: values[":" + name] for name in ACTR_PARAMETERS},
+                                               handle.model_generation)
+    else:
+        warm.applied = dict(warm.defaults)
+        warm.generation = handle.model_generation
+    return warm
+
+def current_warm_model(model="simon-motivation-model3"):
+    """
+    The WarmModel of model on the current ACT-R connection, or None if the connection has none
+    or another reset or load made its parameters unknown
+    """
+    handle = actr.connection()
+    warm = WARM_MODELS.get(handle)
+    if warm is None or warm.model != model or warm.generation != handle.model_generation:
+        return None
+    return warm
+
+def epoch_cache_key(model="simon-motivation-model3", param_set=None, epoch=0, n_session=1, base_seed=SEED, **options):
+    """
+    Cache key of run_epoch(): a hash of the model sources (and simon-hooks.lisp), the parameters,
+    the number of trials, the seeds and the options which change how the model is run or what is
+    recorded: pipeline (trial timing), capture and events (how trials are recorded), snapshot and
+    warm (how the model is brought back to its initial state). verbose is not part of the key
+    Return None if the epoch has no seed (base_seed=None and no "seed" in param_set): ACT-R then
+    picks a random :seed and the result can not be replayed
+    """
+    param_set = dict(param_set or {})
+    if base_seed is None and param_set.get("seed") is None:
+        return None
+    sources = model_files(model)
+    sources.append(os.path.join(os.path.dirname(sources[0]), "simon-hooks.lisp"))
+    return cache_key(sources, model=model, param_set=param_set, epoch=epoch, n_session=n_session,
+                     n_trials=param_set.get("n_trials", 20), seeds=[base_seed, param_set.get("seed")],
+                     pipeline=bool(options.get("pipeline")), capture=options.get("capture", "poll"),
+                     events=options.get("events", "all"), snapshot=bool(options.get("snapshot")),
+                     warm=bool(options.get("warm")))
+
+def cached_epochs(function, epochs, cache, ports=None, host="127.0.0.1"):
+    """
+    Like map_epochs(), but epochs found in cache are not run again and new results are added to it
+    Epochs without a seed (see epoch_cache_key()) are always run and never cached
+    Yield results in epoch order
+    """
+    keys = [epoch_cache_key(**kwargs) for kwargs in epochs]
+    results = [cache.get(key) if key else None for key in keys]
+    pending = [kwargs for kwargs, result in zip(epochs, results) if result is None]
+    if ports and pending:
+        fresh = map_epochs(function, pending, ports=ports, host=host)
+    else:
+        fresh = (function(**kwargs) for kwargs in pending)
+
+    for key, result in zip(keys, results):
+        if result is None:
+            result = next(fresh)
+            if key:
+                result = cache.put(key, result)
+        yield result
+
 def run_simulation(model="simon-motivation-model3",
                    param_set=None,
                    n_simulation=1,
                    n_session=1,
                    verbose=False,
                    log=False,
-                   load=False):
+                   load=False,
+                   ports=None,
+                   host="127.0.0.1",
+                   pipeline=False,
+                   capture="poll",
+                   events="all",
+                   columns=None,
+                   filters=None,
+                   cache=None,
+                   base_seed=SEED,
+                   snapshot=False,
+                   warm=False):
     """
     Run simulation for different parameters
+    If ports are given, epochs are run in parallel with one worker process per ACT-R server
+    With load=True the results saved under log are returned instead, see load_simulation()
+    With cache (a ResultCache, or True for data/cache/) epochs are only run if their result is not
+    cached yet, see epoch_cache_key(); with base_seed=None and no "seed" in param_set nothing is cached
+    Seeds of every session are derived from base_seed, see run_epoch()
+    snapshot=True starts every epoch from a reset of the loaded model instead of loading it, see restore_model()
+    warm=True keeps the model loaded in each worker and only sends changed parameters, see WarmModel
 
     """
     if load:
-        df_model, df_param = load_simulation(log=log)
+        df_model, df_param = load_simulation(log=log, columns=columns, filters=filters)
         return df_model, df_param
     else:
         model_list = []
         param_list = []
 
         # number of simulation per parameter sets
-        for j in tqdm(range(n_simulation)):
-            if verbose: print("Epoch #%03d" % j)
-
-            # number of sessions per experiment
-            list_session_i = []
-            list_session_i_param = []
-            for i in range(n_session):
-                if verbose: print("\tSession #%03d" % i)
-                session_i = run_experiment(model,
-                                         reload=(not i),
-                                         visible=False,
-                                         verbose=verbose,
-                                         trace=False,
-                                         param_set=param_set)
-                df_session_i = session_i.df_stats_model_outputs()
-
-                # log parameter file
-                session_i_param = pd.Series(session_i.parameters)
-                session_i_param['session'] = i+1
-
-                # log session index
-                df_session_i.insert(0, "session", i+1)
-
-                list_session_i.append(df_session_i)
-                list_session_i_param.append(session_i_param)
-
-            df_epoch_j = pd.concat(list_session_i, axis=0)
-            df_epoch_j_param = pd.DataFrame(list_session_i_param)
-
-            # log simulation index
-            df_epoch_j.insert(0, "epoch", j+1)
+        epochs = [{"model": model, "param_set": param_set, "epoch": j, "n_session": n_session, "verbose": verbose,
+                   "pipeline": pipeline, "capture": capture, "events": events, "base_seed": base_seed,
+                   "snapshot": snapshot, "warm": warm}
+                  for j in range(n_simulation)]
+        if cache:
+            cache = ResultCache(os.path.join(os.path.realpath(".."), "data", "cache")) if cache is True else cache
+            results = cached_epochs(run_epoch, epochs, cache, ports=ports, host=host)
+        elif ports:
+            results = map_epochs(run_epoch, epochs, ports=ports, host=host)
+        else:
+            results = (run_epoch(**kwargs) for kwargs in epochs)
 
+        for df_epoch_j, df_epoch_j_param in tqdm(results, total=n_simulation):
             # append all sessions
             model_list.append(df_epoch_j)
             param_list.append(df_epoch_j_param)
@@ -1049,37 +1838,47 @@ def run_simulation(model="simon-motivation-model3",
 
 def save_simulation(dir_name, df_model, df_param):
     """
-    Save simulation results
+    Save simulation results as new files in the result store data/<dir_name>/ (see result_store.py)
     """
     print("......>>> SAVING SIMULATION DATA <<<......")
-    data_dir = os.path.join(os.path.realpath(".."), "data", dir_name + datetime.now().strftime("%y%m%d"))
-    if not os.path.exists(data_dir):
-        os.mkdir(data_dir)
+    ResultStore(os.path.join(os.path.realpath(".."), "data"), dir_name).append(df_model, df_param)
 
-    if os.path.exists(os.path.join(data_dir, "model_output.csv")):
-        mode, header = 'a', False
-    else:
-        mode, header = 'w', True
-    df_model.to_csv(os.path.join(data_dir , "model_output.csv"), index=False,  mode=mode, header=header)
-
-    if os.path.exists(os.path.join(data_dir, "log.csv")):
-        mode, header = 'a', False
-    else:
-        mode, header = 'w', True
-    df_param.to_csv(os.path.join(data_dir, "log.csv"), index=False,  mode=mode, header=header)
-
-def load_simulation(log):
+def load_simulation(log, columns=None, filters=None):
     """
     Load Simulation data
+    :param columns: model output columns to read (default: all)
+    :param filters: dict of column -> value or list of values, e.g. {"motivation": [1, 2], "init_cost": 0.05}
+    Results of the store data/<log>/ and those saved before it existed (data/<log><yymmdd>/model_output.csv)
+    are returned together
     """
-    try:
-        data_dir = glob.glob(os.path.join(os.path.realpath(".."), "data", log + "*"))
+    models, params, names = [], [], []
+    store = ResultStore(os.path.join(os.path.realpath(".."), "data"), log)
+    if store.exists():
+        df_model, df_param = store.load(columns=columns, filters=filters)
+        models.append(df_model)
+        params.append(df_param)
+        names.append(store.path.split('/')[-1])
+
+    data_dir = sorted(glob.glob(os.path.join(os.path.realpath(".."), "data", log + "[0-9]" * 6)))
+    if data_dir:
         df_model = pd.concat([pd.read_csv(os.path.join(d, "model_output.csv")) for d in data_dir], axis=0)
         df_param = pd.concat([pd.read_csv(os.path.join(d, "log.csv")) for d in data_dir], axis=0)
-        print("......>>> LOAD SIMULATION DATA <<<......\n[%s]" % [d.split('/')[-1] for d in data_dir])
-        return df_model, df_param
-    except:
-        raise ValueError
+        for name, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            if name in df_model.columns:
+                df_model = df_model[df_model[name].isin(values)]
+            if name in df_param.columns:
+                df_param = df_param[df_param[name].isin(values)]
+        if columns:
+            df_model = df_model[[c for c in columns if c in df_model.columns]]
+        models.append(df_model)
+        params.append(df_param)
+        names.extend(d.split('/')[-1] for d in data_dir)
+
+    if not names:
+        raise ValueError("No simulation data for %s" % log)
+    print("......>>> LOAD SIMULATION DATA <<<......\n%s" % names)
+    return pd.concat(models, axis=0, ignore_index=True), pd.concat(params, axis=0, ignore_index=True)
 
 '''
 def run_simulation(model="simon-motivation-model3", param_set=None, n_simulation=1, n_session=1, verbose=True, log=True, special_suffix=""):
@@ -0,0 +1,88 @@
+## ================================================================ ##
+## SWEEP.PY                                                         ##
+## ================================================================ ##
+## On-disk index of completed parameter sets for parameter sweeps.  ##
+## Parameter values are canonicalized (floats rounded, booleans     ##
+## normalized) so that a cell is recognized regardless of float     ##
+## round-off or the file it was read from.                          ##
+## ================================================================ ##
+import csv
+import json
+import os
+
+SWEEP_PARAMETERS = ("motivation", "init_cost", "update_cost", "valid_cue_percentage")
+
+
+def canonical_value(value, digits=9):
+    """Canonical string of a parameter value: 0.1 == 0.10000000000000001 == "0.1", True == "True" """
+    if str(value) in ("True", "False"):
+        return str(value)
+    try:
+        return repr(round(float(value), digits) + 0.0)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def canonical_key(param_set, names=SWEEP_PARAMETERS):
+    return json.dumps([canonical_value(param_set[name]) for name in names])
+
+
+class SweepIndex:
+    """
+    Append-only index of completed parameter sets
+
+    Example:
+        index = SweepIndex("../data/sweep_index.jsonl", legacy_log="../data/log.csv")
+        for param_set in index.remaining(param_sets):
+            run_simulation(param_set=param_set)
+            index.add(param_set)
+    """
+
+    def __init__(self, path, names=SWEEP_PARAMETERS, legacy_log=None):
+        """
+        :param path: index file, one canonical parameter set per line
+        :param legacy_log: log.csv used to seed the index when the index file does not exist yet
+        """
+        self.path = path
+        self.names = tuple(names)
+        self.completed = set()
+        if os.path.exists(self.path):
+            self.load()
+        elif legacy_log and os.path.exists(legacy_log):
+            self.import_log(legacy_log)
+
+    def load(self):
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self.completed.add(line)
+
+    def import_log(self, logfile):
+        """Add every parameter set found in a parameter log (e.g. log.csv) to the index"""
+        with open(logfile, newline="") as f:
+            param_sets = [row for row in csv.DictReader(f) if all(row.get(name) for name in self.names)]
+        self.add(*param_sets)
+
+    def __contains__(self, param_set):
+        return canonical_key(param_set, self.names) in self.completed
+
+    def __len__(self):
+        return len(self.completed)
+
+    def remaining(self, param_sets):
+        """Parameter sets that are not completed yet, in their original order"""
+        return [p for p in param_sets if canonical_key(p, self.names) not in self.completed]
+
+    def add(self, *param_sets):
+        """Mark parameter sets as completed"""
+        keys = [canonical_key(p, self.names) for p in param_sets]
+        keys = [k for k in dict.fromkeys(keys) if k not in self.completed]
+        if not keys:
+            return
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(self.path, "a") as f:
+            f.write("".join(k + "\n" for k in keys))
+        self.completed.update(keys)